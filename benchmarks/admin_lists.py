@@ -0,0 +1,86 @@
+"""
+The admin list pages of the favorites table, Flask-Admin's ModelView next to the views
+of src/admin.py: the first page, the pages that follow one another (clicking next) and
+a search of the users by email.
+
+    python benchmarks/admin_lists.py --users 10000 --favorites 100   # 1M favorites
+
+ModelView counts every row for each page and skips the pages before with OFFSET, the
+admin's views show the estimated count and start each page after the last key of the
+previous one.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(tempfile.gettempdir(), "admin_bench.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_PATH
+os.environ.setdefault("CACHE_URL", "memory://")
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from seed import seed  # noqa: E402
+
+
+def timed(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    response.get_data()
+    assert response.status_code == 200, (url, response.status_code)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--favorites", type=int, default=100, help="favorites per user")
+    parser.add_argument("--pages", type=int, default=200, help="next clicks from the first page")
+    args = parser.parse_args()
+
+    from flask import Flask
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+    from sqlalchemy import text
+    from admin import CatalogView, FavoritesView, UserView
+    from app import create_app
+    from models import db, Favorites, User
+    from resources import CATALOG
+
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    with create_app().app_context():
+        db.create_all()
+        seed(1000, args.users, args.favorites)
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=os.environ["DATABASE_URL"], SECRET_KEY="bench")
+    db.init_app(app)
+    admin = Admin(app, template_mode="bootstrap3")
+    admin.add_view(ModelView(Favorites, db.session, endpoint="plain_favorites"))
+    plain_users = type("PlainUserView", (ModelView,), {"column_searchable_list": ("email",)})
+    admin.add_view(plain_users(User, db.session, endpoint="plain_users"))
+    admin.add_view(FavoritesView(Favorites, db.session))
+    admin.add_view(UserView(User, db.session))
+    # the favorites link to their entries
+    for resource in CATALOG.values():
+        admin.add_view(CatalogView(resource.model, db.session))
+    client = app.test_client()
+
+    print("%-10s %-30s %10s %10s" % ("", "", "p50 ms", "max ms"))
+    for label, favorites, users in (("ModelView", "plain_favorites", "plain_users"), ("admin.py", "favorites", "user")):
+        first = [timed(client, "/admin/%s/" % favorites) for _ in range(5)]
+        following = [timed(client, "/admin/%s/?page=%d" % (favorites, page)) for page in range(1, args.pages + 1)]
+        search = [timed(client, "/admin/%s/?search=user%d" % (users, number)) for number in range(1, 21)]
+        for name, timings in (("first page", first), ("next %d pages" % args.pages, following),
+                              ("users search by email", search)):
+            print("%-10s %-30s %10.2f %10.2f" % (label, name, statistics.median(timings), max(timings)))
+    os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
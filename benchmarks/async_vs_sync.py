@@ -0,0 +1,145 @@
+"""
+Side by side: the read endpoints served by gunicorn (src/wsgi.py, gthread workers) and
+by uvicorn (src/asgi.py, async engine), first on their own and then while a crowd of
+slow clients trickles request headers into the same server.
+
+    python benchmarks/async_vs_sync.py --scale 100k --workers 1 --threads 4 --slow-clients 200
+
+Every gthread thread that is reading a slow request is stuck until it completes, the
+event loop of the ASGI server keeps serving the other clients meanwhile.
+"""
+import argparse
+import http.client
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run import CATALOG, free_port, server_command, start_server, summarize  # noqa: E402
+from seed import SCALES, seed  # noqa: E402
+
+
+def read_scenarios(rows, users):
+    return [
+        ("list first page", lambda rng: "/%s?limit=20" % rng.choice(CATALOG)),
+        ("detail", lambda rng: "/%s/%d" % (rng.choice(CATALOG), rng.randint(1, rows))),
+        ("user favorites expanded", lambda rng: "/users/%d/favorites?expand=1" % rng.randint(1, users)),
+    ]
+
+
+def slow_client(port, stop):
+    # sends one more header line every second and never finishes the request
+    try:
+        sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+        sock.sendall(b"GET / HTTP/1.1\r\nHost: bench\r\n")
+        while not stop.wait(1):
+            sock.sendall(b"X-Slow: 1\r\n")
+    except OSError:
+        return
+    sock.close()
+
+
+def drive(port, path, requests, concurrency, timeout):
+    timings = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(index):
+        rng = random.Random("%s %d" % (port, index))
+        own = []
+        failed = 0
+        for _ in range(requests // concurrency):
+            start = time.perf_counter()
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+                connection.request("GET", path(rng))
+                connection.getresponse().read()
+                connection.close()
+                own.append(time.perf_counter() - start)
+            except OSError:
+                failed += 1
+        with lock:
+            timings.extend(own)
+            errors.append(failed)
+
+    clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    wall_start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    result = summarize(timings, time.perf_counter() - wall_start) if timings else {"requests": 0}
+    result["errors"] = sum(errors)
+    return result
+
+
+def measure(asgi, args, plan):
+    port = free_port()
+    server = start_server(server_command(port, args.workers, args.threads, asgi), port, args.workers)
+    results = {}
+    try:
+        for slow_clients in (0, args.slow_clients):
+            stop = threading.Event()
+            crowd = [threading.Thread(target=slow_client, args=(port, stop)) for _ in range(slow_clients)]
+            for thread in crowd:
+                thread.start()
+            time.sleep(1 if slow_clients else 0)
+            for name, path in plan:
+                results[(name, slow_clients)] = drive(port, path, args.requests, args.concurrency, args.timeout)
+            stop.set()
+            for thread in crowd:
+                thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def cell(result):
+    if not result.get("p50_ms"):
+        return "%9s %9s %7s %6d" % ("-", "-", "-", result["errors"])
+    return "%9.2f %9.2f %7s %6d" % (result["p50_ms"], result["p95_ms"], result["throughput_rps"], result["errors"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k", help="rows per catalog table")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--favorites", type=int, default=100, help="favorites per user")
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent measured clients")
+    parser.add_argument("--slow-clients", type=int, default=200, help="clients holding a half sent request")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes of both servers")
+    parser.add_argument("--threads", type=int, default=4, help="gthread threads per sync worker")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a measured request fails")
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+    app = create_app()
+
+    rows = SCALES[args.scale]
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(rows, args.users, args.favorites)
+
+    plan = read_scenarios(rows, args.users)
+    sync = measure(False, args, plan)
+    async_ = measure(True, args, plan)
+
+    print("%-24s %5s | %-35s | %-35s" % ("", "", "gunicorn gthread (wsgi.py)", "uvicorn (asgi.py)"))
+    print("%-24s %5s | %9s %9s %7s %6s | %9s %9s %7s %6s" % (
+        "scenario", "slow", "p50 ms", "p95 ms", "req/s", "errors", "p50 ms", "p95 ms", "req/s", "errors"))
+    for slow_clients in (0, args.slow_clients):
+        for name, path in plan:
+            key = (name, slow_clients)
+            print("%-24s %5d | %s | %s" % (name, slow_clients, cell(sync[key]), cell(async_[key])))
+
+
+if __name__ == "__main__":
+    main()
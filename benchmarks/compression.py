@@ -0,0 +1,68 @@
+"""
+Response sizes and the time spent compressing a list response, per encoding, when it
+is compressed on every request and when the compressed variant comes from the cache.
+
+    python benchmarks/compression.py --rows 2000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "compression_bench.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_PATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from app import create_app  # noqa: E402
+from cache import catalog_cache  # noqa: E402
+from models import db  # noqa: E402
+from seed import seed  # noqa: E402
+import compression  # noqa: E402
+
+app = create_app()
+
+
+def timed(repeat, function):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--path", default="/characters?limit=100")
+    parser.add_argument("--repeat", type=int, default=50, help="best of N runs is reported")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.rows, users=0, favorites=0)
+    client = app.test_client()
+    body = client.get(args.path).get_data()
+    print("%s: %d bytes uncompressed" % (args.path, len(body)))
+    for encoding in compression.ENCODINGS:
+        compress, compressed = timed(args.repeat, lambda: compression.compress(body, encoding))
+        catalog_cache.clear()
+        client.get(args.path, headers={"Accept-Encoding": encoding})
+        cached, response = timed(args.repeat, lambda: client.get(args.path, headers={"Accept-Encoding": encoding}))
+        identity, _ = timed(args.repeat, lambda: client.get(args.path))
+        print("%-5s %7d bytes (%4.1f%%)  compress %6.2f ms  cached request %6.2f ms (identity %6.2f ms)" % (
+            encoding, len(compressed), 100.0 * len(compressed) / len(body), compress * 1000,
+            cached * 1000, identity * 1000))
+        assert response.headers["Content-Encoding"] == encoding
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+    os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares the five favorites_<kind> tables (migration b5d08e6a3c17) with the single
+favorites table keyed by (user_id, kind, entity_id): on-disk size and the time to read
+every favorite of a user, on throwaway SQLite files holding only the favorites.
+
+    python benchmarks/favorites_store.py --users 10000 --favorites 100
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from resources import CATALOG  # noqa: E402
+
+CATALOG_SIZE = 1000
+OLD_COLUMNS = {"planets": "planets_id", "characters": "character_id", "films": "films_id",
+               "vehicles": "vehicles_id", "species": "species_id"}
+
+
+def per_table(resources):
+    # one table per kind, with the unique (user_id, <kind>_id) constraint and the
+    # <kind>_id index of migration 0d207a1c60e2
+    schema = []
+    for resource in resources:
+        table, column = "favorites_" + resource.name, OLD_COLUMNS[resource.name]
+        schema += [f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, "
+                   f"{column} INTEGER NOT NULL, UNIQUE (user_id, {column}))",
+                   f"CREATE INDEX ix_{table}_{column} ON {table} ({column})"]
+    read = " UNION ALL ".join(
+        f"SELECT '{resource.name}' AS kind, id, user_id, {OLD_COLUMNS[resource.name]} AS entity_id "
+        f"FROM favorites_{resource.name} WHERE user_id = :user_id" for resource in resources) + " ORDER BY kind, id"
+
+    def insert(connection, resource, rows):
+        connection.executemany(f"INSERT INTO favorites_{resource.name} (user_id, {OLD_COLUMNS[resource.name]}) "
+                               f"VALUES (?, ?)", rows)
+    return schema, read, insert
+
+
+def unified(resources):
+    # as models.Favorites creates it on SQLite
+    schema = ["CREATE TABLE favorites (user_id INTEGER NOT NULL, kind SMALLINT NOT NULL, "
+              "entity_id INTEGER NOT NULL, PRIMARY KEY (user_id, kind, entity_id)) WITHOUT ROWID",
+              "CREATE INDEX ix_favorites_kind_entity_id ON favorites (kind, entity_id)"]
+    read = "SELECT kind, user_id, entity_id FROM favorites WHERE user_id = :user_id ORDER BY kind, entity_id"
+
+    def insert(connection, resource, rows):
+        connection.executemany("INSERT INTO favorites (user_id, kind, entity_id) VALUES (?, %d, ?)" % resource.code,
+                               rows)
+    return schema, read, insert
+
+
+def build(path, layout, users, favorites):
+    if os.path.exists(path):
+        os.remove(path)
+    schema, read, insert = layout(list(CATALOG.values()))
+    connection = sqlite3.connect(path)
+    for statement in schema:
+        connection.execute(statement)
+    rng = random.Random(42)
+    per_kind = min(favorites // len(CATALOG), CATALOG_SIZE)
+    for resource in CATALOG.values():
+        insert(connection, resource, [(user_id, entity_id) for user_id in range(1, users + 1)
+                                      for entity_id in rng.sample(range(1, CATALOG_SIZE + 1), per_kind)])
+    connection.commit()
+    connection.execute("VACUUM")
+    return connection, read
+
+
+def measure(connection, read, users, requests):
+    rng = random.Random(7)
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        connection.execute(read, {"user_id": rng.randint(1, users)}).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50": statistics.median(timings),
+        "p95": timings[int(len(timings) * 0.95) - 1],
+        "mean": statistics.fmean(timings)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--favorites", type=int, default=100, help="favorites per user, spread over the five kinds")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    for label, layout in (("5 tables", per_table), ("unified", unified)):
+        path = os.path.join(tempfile.gettempdir(), "favorites_store_bench.db")
+        connection, read = build(path, layout, args.users, args.favorites)
+        result = measure(connection, read, args.users, args.requests)
+        connection.close()
+        size = os.path.getsize(path)
+        os.remove(path)
+        print(f"{label:>8}: {size / 1048576:6.1f} MiB ({size / (args.users * args.favorites):5.1f} B/favorite)  "
+              f"p50 {result['p50']:.3f} ms  p95 {result['p95']:.3f} ms  mean {result['mean']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
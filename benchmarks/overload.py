@@ -0,0 +1,119 @@
+"""
+A gunicorn server pushed past its capacity, with and without admission control
+(src/admission.py): clients pulling full list dumps (expensive) next to clients
+reading catalog details (cheap), every client as fast as it can.
+
+    python benchmarks/overload.py --scale 100k --threads 4 --dump-clients 16 --read-clients 16
+    python benchmarks/overload.py --rate-limit 50     # per client token buckets as well
+
+Without it every request waits its turn behind the dumps. With it the worker takes
+ADMISSION_MAX_CONCURRENCY (--threads) requests at a time, keeps part of them for the
+cheap ones and answers the rest with a 503 at once. Every client sends its own
+X-Forwarded-For address (PROXY_HOPS=1), so they get their own bucket.
+"""
+import argparse
+import http.client
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run import CATALOG, free_port, server_command, start_server, summarize  # noqa: E402
+from seed import SCALES, seed  # noqa: E402
+
+
+def client(port, name, address, path, deadline, results, lock, timeout):
+    rng = random.Random(name)
+    own = {"timings": [], "statuses": {}}
+    connection = None
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+            connection.request("GET", path(rng), headers={"X-Forwarded-For": address})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if status == 200:
+                own["timings"].append(time.perf_counter() - start)
+            elif response.getheader("Retry-After"):
+                # a real client would wait Retry-After, a short pause keeps the pressure on
+                time.sleep(0.05)
+        except OSError:
+            status = "error"
+            connection = None
+        own["statuses"][status] = own["statuses"].get(status, 0) + 1
+    with lock:
+        results["timings"].extend(own["timings"])
+        for status, count in own["statuses"].items():
+            results["statuses"][status] = results["statuses"].get(status, 0) + count
+
+
+def measure(admission, args, rows):
+    os.environ.update(PROXY_HOPS="1", RATE_LIMIT=str(args.rate_limit if admission else 0),
+                      ADMISSION_MAX_CONCURRENCY=str(args.threads if admission else 0))
+    # --threads on the command line wins over gunicorn.conf.py, spare threads included
+    threads = args.threads + (args.spare_threads if admission else 0)
+    port = free_port()
+    server = start_server(server_command(port, 1, threads), port, 1)
+    lock = threading.Lock()
+    groups = {
+        "dump (expensive)": (args.dump_clients, lambda rng: "/%s?stream=1" % rng.choice(CATALOG)),
+        "detail (cheap)": (args.read_clients, lambda rng: "/%s/%d" % (rng.choice(CATALOG), rng.randint(1, rows))),
+    }
+    results = {group: {"timings": [], "statuses": {}} for group in groups}
+    deadline = time.perf_counter() + args.seconds
+    try:
+        clients = [threading.Thread(target=client, args=(port, "%s %d" % (group, i), "10.%d.0.%d" % (index, i),
+                                                         path, deadline, results[group], lock, args.timeout))
+                   for index, (group, (count, path)) in enumerate(groups.items()) for i in range(count)]
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k", help="rows per catalog table")
+    parser.add_argument("--threads", type=int, default=4, help="gthread threads, and admitted requests")
+    parser.add_argument("--spare-threads", type=int, default=4, help="extra threads answering 503s")
+    parser.add_argument("--dump-clients", type=int, default=16)
+    parser.add_argument("--read-clients", type=int, default=16)
+    parser.add_argument("--rate-limit", type=float, default=0, help="RATE_LIMIT per client with admission control")
+    parser.add_argument("--seconds", type=float, default=10, help="length of every run")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds before a request fails")
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+    app = create_app()
+
+    rows = SCALES[args.scale]
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(rows, 10, 10)
+
+    print("%-22s %-18s %9s %9s %8s  %s" % ("", "requests", "p50 ms", "p95 ms", "ok/s", "statuses"))
+    for admission in (False, True):
+        results = measure(admission, args, rows)
+        for group, result in results.items():
+            timings = result["timings"]
+            summary = summarize(timings, args.seconds) if timings else {"p50_ms": 0, "p95_ms": 0, "throughput_rps": 0}
+            print("%-22s %-18s %9.2f %9.2f %8s  %s" % (
+                "admission control" if admission else "no admission control", group, summary["p50_ms"],
+                summary["p95_ms"], summary["throughput_rps"],
+                ", ".join("%s: %d" % item for item in sorted(result["statuses"].items(), key=str))))
+
+
+if __name__ == "__main__":
+    main()
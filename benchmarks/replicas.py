@@ -0,0 +1,93 @@
+"""
+Read replica routing on local SQLite files: the primary is seeded and copied to
+--replicas read-only files, then reads, a write, reads inside and after the fence and
+a lost replica show where every read-only request went.
+
+    python benchmarks/replicas.py --replicas 2 --policy least_connections
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+DIR = tempfile.mkdtemp(prefix="replicas_bench")
+PRIMARY = os.path.join(DIR, "primary.db")
+
+READS = ["/planets?limit=20", "/planets/1", "/users", "/users/1/favorites?expand=1", "/planets/top", "/search?q=planet"]
+
+
+def replica_path(index):
+    return os.path.join(DIR, "replica%d.db" % index)
+
+
+def report(label, replicas):
+    stats = replicas.stats()
+    reads = "  ".join("replica%d %3d%s" % (index, replica["reads"], "" if replica["healthy"] else " (down)")
+                      for index, replica in enumerate(stats["replicas"]))
+    print("%-34s primary %3d  %s" % (label, stats["primary_reads"], reads))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--replicas", type=int, default=2)
+    parser.add_argument("--policy", choices=("round_robin", "least_connections"), default="round_robin")
+    parser.add_argument("--rounds", type=int, default=10, help="passes over the read-only routes per step")
+    parser.add_argument("--max-lag", type=float, default=0.5)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + PRIMARY,
+        "DATABASE_REPLICA_URLS": ",".join("sqlite:///file:%s?mode=ro&uri=true" % replica_path(index)
+                                          for index in range(args.replicas)),
+        "REPLICA_POLICY": args.policy,
+        "REPLICA_MAX_LAG": str(args.max_lag),
+        # every read reaches the database
+        "CACHE_MAXSIZE": "0"
+    })
+    from app import create_app
+    from models import db
+    from seed import seed
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        seed(100, users=10, favorites=10)
+    for index in range(args.replicas):
+        shutil.copy(PRIMARY, replica_path(index))
+    replicas = app.extensions["replicas"]
+    client = app.test_client()
+    # seeding committed on the primary
+    time.sleep(args.max_lag)
+
+    def read_all():
+        for _ in range(args.rounds):
+            for path in READS:
+                assert client.get(path).status_code == 200, path
+
+    read_all()
+    report("reads", replicas)
+    client.post("/favorite/1/planets/100")
+    favorites = client.get("/users/1/favorites").json["favorite planets"]
+    assert any(favorite["planets_id"] == 100 for favorite in favorites), "write not read back"
+    report("write, then read it back", replicas)
+    read_all()
+    report("reads within REPLICA_MAX_LAG", replicas)
+    time.sleep(args.max_lag)
+    read_all()
+    report("reads after REPLICA_MAX_LAG", replicas)
+    if args.replicas > 1:
+        # a pooled SQLite connection keeps a removed file readable, drop it as a server restart would
+        os.rename(replica_path(0), replica_path(0) + ".down")
+        replicas.replicas[0].engine.dispose()
+        replicas.check()
+        read_all()
+        report("reads with replica0 down", replicas)
+    shutil.rmtree(DIR)
+
+
+if __name__ == "__main__":
+    main()
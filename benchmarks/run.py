@@ -0,0 +1,285 @@
+"""
+Benchmarks every route of src/app.py against a seeded throwaway database.
+
+    python benchmarks/run.py --scale 1k                      # Flask test client, in process
+    python benchmarks/run.py --scale 100k --server --workers 4 --concurrency 16
+    python benchmarks/run.py --scale 100k --server --asgi --workers 4 --concurrency 16
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --compare benchmarks/baseline.json --tolerance 0.25
+
+Reports p50/p95/p99 latency and throughput per scenario and the peak RSS of the
+process (or of every server worker with --server). --compare exits with status 1
+when the p95 of any scenario regressed by more than --tolerance against the baseline.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, "..", "src")
+DB_PATH = os.path.join(tempfile.gettempdir(), "star_wars_bench.db")
+# always the throwaway file: main() drops every table, DATABASE_URL from .env is likely the dev database
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_PATH
+sys.path.insert(0, SRC_DIR)
+
+from seed import SCALES, seed  # noqa: E402
+
+CATALOG = ("planets", "characters", "films", "vehicles", "species")
+
+
+def scenarios(rows, users):
+    """(name, method, path factory, body factory, requests weight) for every route."""
+    def catalog_id(rng):
+        return rng.randint(1, rows)
+
+    def user_id(rng):
+        return rng.randint(1, users)
+
+    def new_name(rng):
+        return {"name": "bench %d" % rng.getrandbits(64), "description": "d", "imageLink": "x"}
+
+    def search_words(rng):
+        # a kind and an id, the words of one entry's name ("planets 42")
+        return "q=%s+%d" % (rng.choice(CATALOG), rng.randrange(rows))
+
+    def batch(rng):
+        return [{"op": rng.choice(("add", "remove")), "kind": rng.choice(CATALOG), "id": catalog_id(rng)}
+                for _ in range(50)]
+
+    result = [
+        ("sitemap", "GET", lambda rng: "/", None, 0.2),
+        ("list first page", "GET", lambda rng: "/%s" % rng.choice(CATALOG), None, 1),
+        ("list deep page", "GET", lambda rng: "/%s?after=%d" % (rng.choice(CATALOG), rows - 150), None, 1),
+        ("list dump stream", "GET", lambda rng: "/%s?stream=1" % rng.choice(CATALOG), None, 0.05),
+        ("detail", "GET", lambda rng: "/%s/%d" % (rng.choice(CATALOG), catalog_id(rng)), None, 1),
+        ("leaderboard", "GET", lambda rng: "/%s/top" % rng.choice(CATALOG), None, 0.5),
+        ("search", "GET", lambda rng: "/search?" + search_words(rng), None, 1),
+        ("users page", "GET", lambda rng: "/users", None, 0.5),
+        ("user favorites", "GET", lambda rng: "/users/%d/favorites" % user_id(rng), None, 1),
+        ("user favorites expanded", "GET", lambda rng: "/users/%d/favorites?expand=1" % user_id(rng), None, 1),
+        ("add favorite", "POST", lambda rng: "/favorite/%d/%s/%d" % (user_id(rng), rng.choice(CATALOG), catalog_id(rng)), None, 0.5),
+        ("remove favorite", "DELETE", lambda rng: "/favorite/%d/%s/%d" % (user_id(rng), rng.choice(CATALOG), catalog_id(rng)), None, 0.5),
+        ("batch favorites", "POST", lambda rng: "/users/%d/favorites" % user_id(rng), batch, 0.2),
+        ("create catalog entry", "POST", lambda rng: "/%s" % rng.choice(("planets", "characters", "vehicles", "species")), new_name, 0.2),
+    ]
+    return result
+
+
+def percentile(timings, fraction):
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def summarize(timings, wall):
+    timings.sort()
+    return {
+        "requests": len(timings),
+        "p50_ms": round(percentile(timings, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+        "throughput_rps": round(len(timings) / wall, 1) if wall else None
+    }
+
+
+def run_in_process(app, plan, requests):
+    client = app.test_client()
+    results = {}
+    for name, method, path, body, weight in plan:
+        rng = random.Random(name)
+        timings = []
+        count = max(5, int(requests * weight))
+        wall_start = time.perf_counter()
+        for _ in range(count):
+            kwargs = {"json": body(rng)} if body else {}
+            start = time.perf_counter()
+            response = client.open(path(rng), method=method, **kwargs)
+            response.get_data()
+            timings.append(time.perf_counter() - start)
+        results[name] = summarize(timings, time.perf_counter() - wall_start)
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return results, {"process": peak_rss_kb}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def worker_peak_rss_kb(master_pid):
+    # VmHWM is the resident set high water mark of every server worker (Linux only),
+    # a single process uvicorn serves from the master itself
+    peaks = {}
+    try:
+        with open("/proc/%d/task/%d/children" % (master_pid, master_pid)) as children:
+            pids = [int(pid) for pid in children.read().split()] or [master_pid]
+    except OSError:
+        return peaks
+    for pid in pids:
+        try:
+            with open("/proc/%d/status" % pid) as status:
+                for line in status:
+                    if line.startswith("VmHWM:"):
+                        peaks["worker %d" % pid] = int(line.split()[1])
+        except OSError:
+            continue
+    return peaks
+
+
+def server_command(port, workers, threads, asgi=False):
+    if asgi:
+        return [sys.executable, "-m", "uvicorn", "asgi:application", "--app-dir", SRC_DIR,
+                "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return [sys.executable, "-m", "gunicorn", "wsgi", "--chdir", SRC_DIR,
+            "--config", os.path.join(BENCH_DIR, "..", "gunicorn.conf.py"), "--bind", "127.0.0.1:%d" % port,
+            "--workers", str(workers), "--threads", str(threads), "--log-level", "warning"]
+
+
+def start_server(command, port, workers):
+    server = subprocess.Popen(command, env=dict(os.environ))
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline or server.poll() is not None:
+                server.kill()
+                raise RuntimeError("%s did not start" % command[2])
+            time.sleep(0.1)
+    # let every worker import the app and open its connections before measuring
+    for _ in range(workers * 4):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        connection.request("GET", "/")
+        connection.getresponse().read()
+        connection.close()
+    return server
+
+
+def run_against_server(plan, requests, workers, threads, concurrency, asgi=False):
+    port = free_port()
+    server = start_server(server_command(port, workers, threads, asgi), port, workers)
+    try:
+        results = {}
+        for name, method, path, body, weight in plan:
+            count = max(concurrency, int(requests * weight))
+            timings = []
+            lock = threading.Lock()
+
+            def client(index):
+                rng = random.Random("%s %d" % (name, index))
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                own = []
+                for _ in range(count // concurrency):
+                    payload = json.dumps(body(rng)) if body else None
+                    headers = {"Content-Type": "application/json"} if body else {}
+                    start = time.perf_counter()
+                    connection.request(method, path(rng), body=payload, headers=headers)
+                    connection.getresponse().read()
+                    own.append(time.perf_counter() - start)
+                connection.close()
+                with lock:
+                    timings.extend(own)
+
+            clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+            wall_start = time.perf_counter()
+            for thread in clients:
+                thread.start()
+            for thread in clients:
+                thread.join()
+            results[name] = summarize(timings, time.perf_counter() - wall_start)
+        return results, worker_peak_rss_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if before is None:
+            print("no baseline for %s, record a new one with --save-baseline" % name)
+        elif result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            regressions.append("%s: p95 %.2f ms -> %.2f ms" % (name, before["p95_ms"], result["p95_ms"]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k", help="rows per catalog table")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--favorites", type=int, default=100, help="favorites per user")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario (scaled by its weight)")
+    parser.add_argument("--no-cache", action="store_true", help="disable the catalog response cache")
+    parser.add_argument("--cache-url", help="cache backend (CACHE_URL), memory:// by default")
+    parser.add_argument("--server", action="store_true", help="drive a multi-worker gunicorn server over HTTP")
+    parser.add_argument("--asgi", action="store_true", help="with --server, run src/asgi.py under uvicorn instead")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent HTTP clients with --server")
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 regression with --compare")
+    args = parser.parse_args()
+
+    if args.no_cache:
+        os.environ["CACHE_MAXSIZE"] = "0"
+    if args.cache_url:
+        os.environ["CACHE_URL"] = args.cache_url
+
+    from app import create_app
+    from models import db
+    app = create_app()
+
+    rows = SCALES[args.scale]
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed_start = time.perf_counter()
+        seed(rows, args.users, args.favorites)
+        print("seeded %d rows per catalog table, %d users x %d favorites in %.1f s" % (
+            rows, args.users, args.favorites, time.perf_counter() - seed_start))
+
+    plan = scenarios(rows, args.users)
+    if args.server:
+        results, peak_rss = run_against_server(plan, args.requests, args.workers, args.threads, args.concurrency,
+                                               args.asgi)
+    else:
+        with app.app_context():
+            results, peak_rss = run_in_process(app, plan, args.requests)
+
+    print("%-26s %8s %10s %10s %10s %10s" % ("scenario", "requests", "p50 ms", "p95 ms", "p99 ms", "req/s"))
+    for name, result in results.items():
+        print("%-26s %8d %10.2f %10.2f %10.2f %10s" % (name, result["requests"], result["p50_ms"],
+                                                       result["p95_ms"], result["p99_ms"], result["throughput_rps"]))
+    for name, kilobytes in peak_rss.items():
+        print("peak RSS %s: %.1f MiB" % (name, kilobytes / 1024))
+
+    report = {
+        "settings": {key: value for key, value in vars(args).items() if key not in ("save_baseline", "compare")},
+        "results": results,
+        "peak_rss_kb": peak_rss
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
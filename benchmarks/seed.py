@@ -0,0 +1,117 @@
+"""
+Seeds a database with synthetic Star Wars data for the benchmarks.
+
+    python benchmarks/seed.py --database-url sqlite:////tmp/bench.db --scale 100k --users 1000 --favorites 200
+    python benchmarks/seed.py --drop    # empties the DATABASE_URL database first
+
+The tables are only dropped when the database is named with --database-url or --drop
+is given, DATABASE_URL alone (from .env, the dev database) is only added to. The search
+index, which create_all() leaves out, is created the way migration 7c3e91b2d4f8 does.
+"""
+import argparse
+import importlib.util
+import os
+import random
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "src"))
+
+from alembic.migration import MigrationContext  # noqa: E402
+from alembic.operations import Operations  # noqa: E402
+from sqlalchemy import insert, inspect, text  # noqa: E402
+
+SEARCH_MIGRATION = os.path.join(BENCH_DIR, "..", "migrations", "versions", "7c3e91b2d4f8_.py")
+
+# rows per catalog table
+SCALES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+CHUNK = 10000
+
+DESCRIPTION = ("A long time ago in a galaxy far, far away, this entry was generated to give the "
+               "benchmarks realistic payload sizes. ") * 3
+
+
+def insert_chunked(db, model, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK:
+            db.session.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(insert(model), chunk)
+
+
+def create_search_index(db):
+    """Runs the upgrade of the search index migration (FTS5 table and triggers on SQLite,
+    GIN indexes on Postgres) unless the index is there, and fills it with the catalog."""
+    connection = db.session.connection()
+    if connection.dialect.name == "sqlite":
+        triggers = connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars()
+        if "planets_search_insert" in triggers.all():
+            return
+        # left behind by a drop_all(), which dropped the triggers with the tables
+        connection.execute(text("DROP TABLE IF EXISTS catalog_search"))
+    elif any(index["name"] == "ix_planets_search" for index in inspect(connection).get_indexes("planets")):
+        return
+    spec = importlib.util.spec_from_file_location("search_migration", SEARCH_MIGRATION)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    with Operations.context(MigrationContext.configure(connection)):
+        migration.upgrade()
+
+
+def seed(rows, users, favorites, random_seed=42):
+    """Fills every catalog table with `rows` entries and gives each of `users` users
+    `favorites` favorites spread over the five kinds. Expects an app context and an
+    empty schema."""
+    from resources import CATALOG
+    from models import db, User, Favorites
+    import counters
+
+    rng = random.Random(random_seed)
+    for name, resource in CATALOG.items():
+        insert_chunked(db, resource.model, (
+            {resource.display.key: f"{name} {i}", "description": DESCRIPTION,
+             "imageLink": f"https://starwars-visualguide.com/assets/img/{name}/{i}.jpg"}
+            for i in range(rows)
+        ))
+    create_search_index(db)
+    insert_chunked(db, User, (
+        {"email": f"user{i}@example.com", "password": "x", "username": f"user{i}"}
+        for i in range(users)
+    ))
+    per_kind = min(favorites // len(CATALOG), rows)
+    for resource in CATALOG.values():
+        insert_chunked(db, Favorites, (
+            {"user_id": user_id, "kind": resource.code, "entity_id": entity_id}
+            for user_id in range(1, users + 1)
+            for entity_id in rng.sample(range(1, rows + 1), per_kind)
+        ))
+    counters.rebuild(db.session)
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="1k", help="rows per catalog table")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--favorites", type=int, default=100, help="favorites per user, spread over the five kinds")
+    parser.add_argument("--database-url", help="database to empty and seed, instead of DATABASE_URL")
+    parser.add_argument("--drop", action="store_true", help="drop every table of DATABASE_URL first")
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    from app import create_app
+    from models import db
+    app = create_app()
+    with app.app_context():
+        if args.database_url or args.drop:
+            db.drop_all()
+        db.create_all()
+        seed(SCALES[args.scale], args.users, args.favorites)
+
+
+if __name__ == "__main__":
+    main()
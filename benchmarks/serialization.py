@@ -0,0 +1,82 @@
+"""
+Compares building a large list response the old way (ORM objects, serialize() and the
+stdlib JSON provider) with the fast path (plain column tuples and FastJSONProvider).
+
+    python benchmarks/serialization.py --rows 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+DB_PATH = os.path.join(tempfile.gettempdir(), "serialization_bench.db")
+os.environ["DATABASE_URL"] = "sqlite:///" + DB_PATH
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+from app import create_app  # noqa: E402
+from resources import RESOURCES  # noqa: E402
+from models import db, Characters  # noqa: E402
+from seed import seed  # noqa: E402
+from serialization import FastJSONProvider, orjson  # noqa: E402
+
+app = create_app()
+
+
+def orm_path(provider):
+    characters = db.session.execute(select(Characters)).scalars().all()
+    payload = {"characters": list(map(lambda character: character.serialize(), characters))}
+    built = time.perf_counter()
+    body = provider.response(payload).get_data()
+    db.session.expunge_all()
+    return built, body
+
+
+def tuple_path(provider):
+    names = RESOURCES["characters"].fields
+    rows = db.session.execute(select(*[getattr(Characters, name) for name in names])).all()
+    payload = {"characters": [dict(zip(names, row)) for row in rows]}
+    built = time.perf_counter()
+    body = provider.response(payload).get_data()
+    return built, body
+
+
+def measure(path, provider, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        built, body = path(provider)
+        end = time.perf_counter()
+        if best is None or end - start < best[0]:
+            best = (end - start, built - start, end - built, len(body))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3, help="best of N runs is reported")
+    args = parser.parse_args()
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        seed(args.rows, users=0, favorites=0)
+        print("encoder: %s" % ("orjson " + orjson.__version__ if orjson else "stdlib (orjson not installed)"))
+        results = [
+            ("ORM + serialize() + stdlib", measure(orm_path, DefaultJSONProvider(app), args.repeat)),
+            ("tuples + FastJSONProvider", measure(tuple_path, FastJSONProvider(app), args.repeat)),
+        ]
+        for label, (total, fetch, encode, size) in results:
+            print("%-28s total %8.1f ms  query+build %8.1f ms  encode %8.1f ms  %6.1f MiB" % (
+                label, total * 1000, fetch * 1000, encode * 1000, size / 1048576))
+        print("speedup: %.1fx" % (results[0][1][0] / results[1][1][0]))
+        db.session.remove()
+        db.drop_all()
+    os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
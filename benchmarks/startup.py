@@ -0,0 +1,122 @@
+"""
+Cold start of the gunicorn server: the time a worker spends importing the app, the time
+from launching gunicorn to its first answered API request, and the memory of every
+worker once all of them served requests, with and without --preload.
+
+    python benchmarks/startup.py --workers 4
+    python benchmarks/startup.py --root /tmp/older-checkout   # same numbers for another tree
+
+PSS splits the pages shared between processes among them and USS only counts a
+worker's own pages, so they show what preloading saves where RSS does not.
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+DB_PATH = os.path.join(tempfile.gettempdir(), "startup_bench.db")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def import_seconds(root, env):
+    # what every worker does on boot without --preload
+    code = "import time; start = time.perf_counter(); import wsgi; print(time.perf_counter() - start)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.join(root, "src"), env=env,
+                            check=True, capture_output=True, text=True).stdout
+    return float(output.split()[-1])
+
+
+def get(port, path):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request("GET", path)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def memory_kb(pid):
+    # from smaps_rollup (Linux 4.14+)
+    values = {}
+    with open("/proc/%d/smaps_rollup" % pid) as smaps:
+        for line in smaps:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                values[name] = int(rest.split()[0])
+    return {"rss": values["Rss"], "pss": values["Pss"], "uss": values["Private_Clean"] + values["Private_Dirty"]}
+
+
+def start(root, env, workers, preload):
+    port = free_port()
+    command = [sys.executable, "-m", "gunicorn", "wsgi", "--chdir", os.path.join(root, "src"),
+               "--config", os.path.join(root, "gunicorn.conf.py"), "--bind", "127.0.0.1:%d" % port,
+               "--workers", str(workers), "--log-level", "warning"]
+    env = dict(env, GUNICORN_PRELOAD="1" if preload else "0")
+    launched = time.perf_counter()
+    server = subprocess.Popen(command, env=env)
+    while True:
+        try:
+            if get(port, "/planets?limit=1") == 200:
+                return server, port, time.perf_counter() - launched
+        except OSError:
+            pass
+        if server.poll() is not None or time.perf_counter() - launched > 60:
+            server.kill()
+            raise RuntimeError("gunicorn did not start")
+        time.sleep(0.01)
+
+
+def measure(root, env, workers, preload, requests):
+    server, port, first_request = start(root, env, workers, preload)
+    try:
+        # with more requests than workers every worker has imported the app (without
+        # --preload) and run the request path once
+        for _ in range(requests):
+            get(port, "/planets?limit=1")
+        with open("/proc/%d/task/%d/children" % (server.pid, server.pid)) as children:
+            pids = [int(pid) for pid in children.read().split()]
+        return first_request, [memory_kb(pid) for pid in pids]
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--root", default=ROOT, help="checkout to measure (its src/ and gunicorn.conf.py)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=200, help="requests sent before reading the memory")
+    parser.add_argument("--repeat", type=int, default=5, help="median of N runs is reported")
+    args = parser.parse_args()
+
+    env = dict(os.environ, DATABASE_URL="sqlite:///" + DB_PATH, CACHE_URL="memory://")
+    if os.path.exists(DB_PATH):
+        os.remove(DB_PATH)
+    subprocess.run([sys.executable, os.path.join(args.root, "benchmarks", "seed.py"), "--users", "10",
+                    "--favorites", "10"], env=env, check=True)
+
+    imports = [import_seconds(args.root, env) for _ in range(args.repeat)]
+    print("import wsgi: %.0f ms (median of %d)" % (statistics.median(imports) * 1000, args.repeat))
+    for preload in (False, True):
+        runs = [measure(args.root, env, args.workers, preload, args.requests) for _ in range(args.repeat)]
+        first_request = statistics.median(run[0] for run in runs)
+        workers = [worker for run in runs for worker in run[1]]
+        print("%-11s first request %6.0f ms  per worker RSS %5.1f MiB  PSS %5.1f MiB  USS %5.1f MiB" % (
+            "preload" if preload else "no preload", first_request * 1000,
+            *(statistics.median(worker[name] for worker in workers) / 1024 for name in ("rss", "pss", "uss"))))
+    os.remove(DB_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# Gunicorn settings, loaded by the Procfile / render.yaml start command.
+# Read more about them here: https://docs.gunicorn.org/en/stable/settings.html
+import gc
+import os
+
+# gthread workers serve several requests per process while others wait on Postgres,
+# src/database.py sizes each worker's connection pool from the same variables
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+if int(os.getenv("ADMISSION_MAX_CONCURRENCY", 0)):
+    # threads that only answer 503 when the others are busy (see src/admission.py)
+    threads += int(os.getenv("ADMISSION_SPARE_THREADS", 4))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+
+# recycle workers now and then so a slow leak can not grow forever
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 2000))
+max_requests_jitter = 200
+
+# the app is imported once by the master and the workers are forked from it, so they
+# start without importing anything and share its memory (GUNICORN_PRELOAD=0 to import
+# it in every worker instead). Nothing in the app connects to the database at import.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1").lower() in ("1", "true", "yes", "on")
+if preload_app:
+    # no collections while the master imports the app, they would leave freed holes in
+    # the pages the workers are going to share
+    gc.disable()
+
+
+def when_ready(server):
+    # the app is loaded and no worker forked yet: move its objects out of the collector's
+    # reach, otherwise every collection in a worker writes to (and so copies) their pages
+    if server.cfg.preload_app:
+        gc.freeze()
+        gc.enable()
@@ -0,0 +1,44 @@
+"""favorites indexes and uniqueness
+
+Revision ID: 0d207a1c60e2
+Revises: 41fac4267c2f
+Create Date: 2026-10-18 09:30:12.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0d207a1c60e2'
+down_revision = '41fac4267c2f'
+branch_labels = None
+depends_on = None
+
+
+FAVORITES = [
+    ('favorites_characters', 'character_id'),
+    ('favorites_films', 'films_id'),
+    ('favorites_planets', 'planets_id'),
+    ('favorites_species', 'species_id'),
+    ('favorites_vehicles', 'vehicles_id'),
+]
+
+
+def upgrade():
+    for table, column in FAVORITES:
+        # drop duplicated favorites (keeping the oldest) so the unique constraint can be created
+        op.execute(
+            f"DELETE FROM {table} WHERE id NOT IN ("
+            f"SELECT id FROM (SELECT MIN(id) AS id FROM {table} GROUP BY user_id, {column}) AS keep)"
+        )
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_unique_constraint(f'uq_{table}_user_id_{column}', ['user_id', column])
+            batch_op.create_index(f'ix_{table}_{column}', [column], unique=False)
+
+
+def downgrade():
+    for table, column in FAVORITES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_{column}')
+            batch_op.drop_constraint(f'uq_{table}_user_id_{column}', type_='unique')
@@ -0,0 +1,62 @@
+"""catalog full-text search indexes
+
+Revision ID: 7c3e91b2d4f8
+Revises: 0d207a1c60e2
+Create Date: 2026-10-18 09:52:40.117305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3e91b2d4f8'
+down_revision = '0d207a1c60e2'
+branch_labels = None
+depends_on = None
+
+
+# table, title column, kind code (the SQLite index uses rowid = id * 8 + code)
+CATALOG = [
+    ('planets', 'name', 1),
+    ('characters', 'name', 2),
+    ('films', 'title', 3),
+    ('vehicles', 'name', 4),
+    ('species', 'name', 5),
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table, title, code in CATALOG:
+            op.create_index(f'ix_{table}_search', table,
+                            [sa.text(f"to_tsvector('english', {title} || ' ' || description)")],
+                            postgresql_using='gin')
+    elif dialect == 'sqlite':
+        op.execute('CREATE VIRTUAL TABLE catalog_search USING fts5('
+                   'kind UNINDEXED, entity_id UNINDEXED, name, description, imageLink UNINDEXED)')
+        for table, title, code in CATALOG:
+            values = f"""(new.id * 8 + {code}, '{table}', new.id, new.{title}, new.description, new."imageLink")"""
+            columns = 'catalog_search (rowid, kind, entity_id, name, description, imageLink)'
+            op.execute(f'CREATE TRIGGER {table}_search_insert AFTER INSERT ON {table} BEGIN '
+                       f'INSERT INTO {columns} VALUES {values}; END')
+            op.execute(f'CREATE TRIGGER {table}_search_update AFTER UPDATE ON {table} BEGIN '
+                       f'DELETE FROM catalog_search WHERE rowid = old.id * 8 + {code}; '
+                       f'INSERT INTO {columns} VALUES {values}; END')
+            op.execute(f'CREATE TRIGGER {table}_search_delete AFTER DELETE ON {table} BEGIN '
+                       f'DELETE FROM catalog_search WHERE rowid = old.id * 8 + {code}; END')
+            op.execute(f'INSERT INTO {columns} SELECT id * 8 + {code}, \'{table}\', id, {title}, '
+                       f'description, "imageLink" FROM {table}')
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for table, title, code in CATALOG:
+            op.drop_index(f'ix_{table}_search', table_name=table)
+    elif dialect == 'sqlite':
+        for table, title, code in CATALOG:
+            for operation in ('insert', 'update', 'delete'):
+                op.execute(f'DROP TRIGGER {table}_search_{operation}')
+        op.execute('DROP TABLE catalog_search')
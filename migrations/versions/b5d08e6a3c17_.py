@@ -0,0 +1,45 @@
+"""favorite counts
+
+Revision ID: b5d08e6a3c17
+Revises: 7c3e91b2d4f8
+Create Date: 2026-10-18 10:04:51.630274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d08e6a3c17'
+down_revision = '7c3e91b2d4f8'
+branch_labels = None
+depends_on = None
+
+
+# favorites table, entity column, kind code
+FAVORITES = [
+    ('favorites_planets', 'planets_id', 1),
+    ('favorites_characters', 'character_id', 2),
+    ('favorites_films', 'films_id', 3),
+    ('favorites_vehicles', 'vehicles_id', 4),
+    ('favorites_species', 'species_id', 5),
+]
+
+
+def upgrade():
+    op.create_table('favorite_counts',
+    sa.Column('kind', sa.SmallInteger(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('kind', 'entity_id')
+    )
+    op.create_index('ix_favorite_counts_kind_count', 'favorite_counts',
+                    ['kind', sa.text('count DESC'), 'entity_id'], unique=False)
+    for table, column, code in FAVORITES:
+        op.execute(f'INSERT INTO favorite_counts (kind, entity_id, count) '
+                   f'SELECT {code}, {column}, COUNT(*) FROM {table} GROUP BY {column}')
+
+
+def downgrade():
+    op.drop_index('ix_favorite_counts_kind_count', table_name='favorite_counts')
+    op.drop_table('favorite_counts')
@@ -0,0 +1,61 @@
+"""one favorites table for every kind
+
+Revision ID: e41a7c9d2b60
+Revises: b5d08e6a3c17
+Create Date: 2026-10-18 15:22:08.417395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e41a7c9d2b60'
+down_revision = 'b5d08e6a3c17'
+branch_labels = None
+depends_on = None
+
+
+# favorites table, entity table, entity column, kind code
+FAVORITES = [
+    ('favorites_planets', 'planets', 'planets_id', 1),
+    ('favorites_characters', 'characters', 'character_id', 2),
+    ('favorites_films', 'films', 'films_id', 3),
+    ('favorites_vehicles', 'vehicles', 'vehicles_id', 4),
+    ('favorites_species', 'species', 'species_id', 5),
+]
+
+
+def upgrade():
+    op.create_table('favorites',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.SmallInteger(), nullable=False),
+    sa.Column('entity_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'kind', 'entity_id'),
+    sqlite_with_rowid=False
+    )
+    op.create_index('ix_favorites_kind_entity_id', 'favorites', ['kind', 'entity_id'], unique=False)
+    for table, entity, column, code in FAVORITES:
+        op.execute(f'INSERT INTO favorites (user_id, kind, entity_id) '
+                   f'SELECT user_id, {code}, {column} FROM {table}')
+        op.drop_table(table)
+
+
+def downgrade():
+    # favorites get new ids, in (kind, user, entity) order
+    for table, entity, column, code in FAVORITES:
+        op.create_table(table,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column(column, sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint([column], [f'{entity}.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', column, name=f'uq_{table}_user_id_{column}')
+        )
+        op.create_index(f'ix_{table}_{column}', table, [column], unique=False)
+        op.execute(f'INSERT INTO {table} (user_id, {column}) '
+                   f'SELECT user_id, entity_id FROM favorites WHERE kind = {code} ORDER BY user_id, entity_id')
+    op.drop_index('ix_favorites_kind_entity_id', table_name='favorites')
+    op.drop_table('favorites')
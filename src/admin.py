@@ -1,7 +1,200 @@
+"""
+The admin, served under /admin (see AdminMount in app.py). Every view is made to browse
+tables of millions of rows without keeping a worker busy:
+
+- the count shown is the planner's estimate (pg_class, sqlite_stat1 once ANALYZE ran),
+  never a COUNT(*); without one, or while searching/filtering, pages are previous/next
+- pages in primary key order start after the last key of the page before (keyset), the
+  keys are remembered in a small cache of their own; pages reached any other way use OFFSET
+- search is a prefix of the unique name/title/email column, a range of its index
+- relationships are never joined into the lists, ids link to the related row instead
+"""
+import json
 import os
+from flask import g, url_for
 from flask_admin import Admin
-from models import db, User
-from flask_admin.contrib.sqla import ModelView
+from flask_admin.contrib.sqla import ModelView, filters
+from markupsafe import Markup
+from sqlalchemy import and_, delete, inspect, or_, select, text, tuple_
+from models import db, User, Favorites, Favorite_counts
+from cache import cache_from_url, catalog_cache
+import counters
+from resources import CATALOG, KINDS
+
+ESTIMATES = {
+    # -1 until the table was first vacuumed/analyzed
+    "postgresql": text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+    # "<rows> <rows per distinct value>...", sqlite_stat1 only exists after ANALYZE
+    "sqlite": text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table LIMIT 1"),
+}
+KIND_OPTIONS = [(resource.code, resource.name) for resource in CATALOG.values()]
+# where the keyset pages start, on CACHE_URL but apart from the API responses
+page_cache = cache_from_url(os.getenv("CACHE_URL", "memory://"), maxsize=256,
+                            ttl=float(os.getenv("CACHE_TTL", 60)), name="admin_pages")
+
+
+def estimated_count(session, table):
+    """Rows in `table` by the planner's statistics, None when there are none."""
+    bind = session.get_bind()
+    statement = ESTIMATES.get(bind.dialect.name)
+    if statement is None:
+        return None
+    if bind.dialect.name == "sqlite" and not inspect(bind).has_table("sqlite_stat1"):
+        return None
+    value = session.execute(statement, {"table": table}).scalar()
+    if value is None:
+        return None
+    value = int(str(value).split()[0])
+    return value if value >= 0 else None
+
+
+def prefix_range(column, prefix):
+    # the values starting with prefix, as a range the column's index can answer
+    # (LIKE 'prefix%' only uses it under the C collation)
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def kind_formatter(view, context, model, name):
+    return KINDS[model.kind].name
+
+
+def user_link(view, context, model, name):
+    return Markup('<a href="%s">%d</a>') % (url_for("user.edit_view", id=model.user_id), model.user_id)
+
+
+def entity_link(view, context, model, name):
+    endpoint = KINDS[model.kind].model.__name__.lower() + ".edit_view"
+    return Markup('<a href="%s">%d</a>') % (url_for(endpoint, id=model.entity_id), model.entity_id)
+
+
+class ScalableView(ModelView):
+    """ModelView with estimated counts, keyset pages and prefix search (see above)."""
+
+    # no COUNT(*) from Flask-Admin, get_list() puts the estimate in its place
+    simple_list_pager = True
+    # relationship columns would be joined into every list query
+    column_auto_select_related = False
+
+    def __init__(self, model, session, column_searchable_list=None, **kwargs):
+        if column_searchable_list is not None:
+            self.column_searchable_list = column_searchable_list
+        self.primary_key = inspect(model).primary_key
+        if self.column_default_sort is None:
+            self.column_default_sort = [(column.key, False) for column in self.primary_key]
+        super().__init__(model, session, **kwargs)
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # the whole text is one prefix, rather than Flask-Admin's ILIKE '%word%' per word
+        # that has to read every row
+        search = search.strip()
+        if search:
+            condition = or_(*(prefix_range(column, search) for column, path in self._search_fields))
+            query = query.filter(condition)
+            if count_query is not None:
+                count_query = count_query.filter(condition)
+        return query, count_query, joins, count_joins
+
+    def _page_key(self, search, filters, page_size, page):
+        # where `page` starts in this listing, shared by the workers through the cache
+        return ("admin-pages", self.endpoint, page_size, search or "", json.dumps(filters or []), page)
+
+    def _apply_pagination(self, query, page, page_size):
+        # the view is shared by the threads, the start of the page is kept in g
+        after = g.pop("admin_page_after", None)
+        if after is None:
+            return super()._apply_pagination(query, page, page_size)
+        return query.filter(tuple_(*self.primary_key) > tuple_(*after)).limit(page_size)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        if page_size is None:
+            page_size = self.page_size
+        keyset = sort_column is None and execute and bool(page_size)
+        if keyset and page:
+            entry = page_cache.get(self._page_key(search, filters, page_size, page))
+            if entry is not None:
+                g.admin_page_after = json.loads(entry[1])
+        count, data = super().get_list(page, sort_column, sort_desc, search, filters, execute, page_size)
+        if keyset and len(data) == page_size:
+            last = inspect(data[-1]).identity
+            page_cache.set(self._page_key(search, filters, page_size, (page or 0) + 1), (b"", json.dumps(last)))
+        if not search and not filters:
+            count = estimated_count(self.session, self.model.__tablename__)
+        return count, data
+
+
+class CatalogView(ScalableView):
+    column_sortable_list = ("id",)
+
+    def on_model_delete(self, model):
+        # favorites has no foreign key to the catalog tables (one table for every kind),
+        # so the entry's favorites and its count go with it here, in the same transaction
+        resource = next(resource for resource in CATALOG.values() if resource.model is self.model)
+        self.session.execute(delete(Favorites).where(Favorites.kind == resource.code,
+                                                     Favorites.entity_id == model.id))
+        self.session.execute(delete(Favorite_counts).where(Favorite_counts.kind == resource.code,
+                                                           Favorite_counts.entity_id == model.id))
+
+    # edits made from the admin must not leave stale entries in the API cache,
+    # expanded favorites embed catalog rows so they are dropped as well
+    def after_model_change(self, form, model, is_created):
+        catalog_cache.invalidate(model.__tablename__)
+        catalog_cache.invalidate("favorites")
+
+    def after_model_delete(self, model):
+        # the table's entries and leaderboard, and every user's favorites
+        catalog_cache.invalidate(model.__tablename__)
+        catalog_cache.invalidate("favorites")
+
+
+class UserView(ScalableView):
+    column_exclude_list = ("password",)
+    column_searchable_list = ("email",)
+    column_sortable_list = ("id", "email")
+    # a select of every favorite of the user would be loaded into the form
+    form_excluded_columns = ("favorites",)
+
+    def on_model_delete(self, model):
+        # user_id is part of the favorites primary key, the relationship can not blank
+        # it out: the favorites go first and the entries they counted are counted again
+        favorited = select(Favorites.kind, Favorites.entity_id).where(Favorites.user_id == model.id)
+        entity_ids = {}
+        for kind, entity_id in self.session.execute(favorited):
+            entity_ids.setdefault(kind, []).append(entity_id)
+        self.session.execute(delete(Favorites).where(Favorites.user_id == model.id))
+        for kind, ids in entity_ids.items():
+            counters.recount(self.session, KINDS[kind], ids)
+        self.session.expire(model, ["favorites"])
+        # the view is shared by the threads, the kinds are kept in g for after_model_delete
+        g.admin_deleted_kinds = [KINDS[kind].name for kind in entity_ids]
+
+    # the user's favorites responses carry the username
+    def after_model_change(self, form, model, is_created):
+        catalog_cache.invalidate("favorites", model.id)
+
+    def after_model_delete(self, model):
+        catalog_cache.invalidate("favorites", model.id)
+        for name in g.pop("admin_deleted_kinds", ()):
+            catalog_cache.invalidate(name, "top")
+
+
+class FavoritesView(ScalableView):
+    # read only: favorites are written through the API, which keeps favorite_counts and
+    # the response cache up to date
+    can_create = can_edit = can_delete = False
+    column_list = ("user_id", "kind", "entity_id")
+    column_sortable_list = ()
+    column_formatters = {"user_id": user_link, "kind": kind_formatter, "entity_id": entity_link}
+    # a user's favorites are a range of the primary key, a kind's of ix_favorites_kind_entity_id
+    column_filters = (filters.IntEqualFilter(Favorites.user_id, "User id"),
+                      filters.IntEqualFilter(Favorites.kind, "Kind", options=KIND_OPTIONS))
+
+
+class FavoriteCountsView(ScalableView):
+    # read only: counters.py keeps the counts (flask rebuild-favorite-counts rebuilds them)
+    can_create = can_edit = can_delete = False
+    column_sortable_list = ()
+    column_formatters = {"kind": kind_formatter, "entity_id": entity_link}
+    column_filters = (filters.IntEqualFilter(Favorite_counts.kind, "Kind", options=KIND_OPTIONS),)
 
 
 def setup_admin(app):
@@ -9,8 +202,11 @@ def setup_admin(app):
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
+    admin.add_view(UserView(User, db.session))
+    for resource in CATALOG.values():
+        admin.add_view(CatalogView(resource.model, db.session, column_searchable_list=(resource.display.key,)))
+    admin.add_view(FavoritesView(Favorites, db.session))
+    admin.add_view(FavoriteCountsView(Favorite_counts, db.session, name="Favorite counts"))
 
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
+    # You can add new models the same way, ScalableView keeps their lists fast
+    # admin.add_view(ScalableView(YourModelName, db.session))
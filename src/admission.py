@@ -0,0 +1,123 @@
+"""
+Admission control: requests over a client's rate or over the worker's capacity are
+answered at once with 429/503 and Retry-After, instead of queueing until everything
+times out together.
+
+    RATE_LIMIT=20                   requests per second per client (default 0, off)
+    RATE_LIMIT_BURST=40             requests a client may send at once (0 for 2 x RATE_LIMIT)
+    ADMISSION_MAX_CONCURRENCY=4     requests a worker handles at once (default 0, off)
+    ADMISSION_EXPENSIVE_SHARE=0.5   part of them expensive requests may take
+
+Cheap requests (cached catalog reads) may use every slot, expensive ones (dumps, writes,
+searches...) only their share, so a burst of expensive work can not starve them.
+
+A worker only sees the requests its threads picked up, the others wait in gunicorn. So
+gunicorn.conf.py gives it ADMISSION_SPARE_THREADS more threads than GUNICORN_THREADS (keep
+ADMISSION_MAX_CONCURRENCY at most GUNICORN_THREADS, the connection pool is sized from it):
+they take the excess requests and answer them right away.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# clients whose buckets are remembered, the least recently seen are forgotten first
+MAX_CLIENTS = 10000
+
+
+class AdmissionControl:
+    """WSGI middleware applying per-client token buckets and the concurrency limit.
+
+    `is_cheap(environ)` tells the cheap requests apart. Clients are told apart by
+    REMOTE_ADDR, which behind a proxy needs PROXY_HOPS (see create_app()).
+    """
+
+    def __init__(self, app, is_cheap, exempt=("/metrics",)):
+        self.wsgi_app = app.wsgi_app
+        self.is_cheap = is_cheap
+        self.exempt = exempt
+        self.rate = float(os.getenv("RATE_LIMIT", 0))
+        self.burst = float(os.getenv("RATE_LIMIT_BURST", 0)) or self.rate * 2
+        self.max_concurrency = int(os.getenv("ADMISSION_MAX_CONCURRENCY", 0))
+        share = float(os.getenv("ADMISSION_EXPENSIVE_SHARE", 0.5))
+        self.max_expensive = max(1, int(self.max_concurrency * share))
+        self.in_flight = 0
+        self.expensive_in_flight = 0
+        self.counters = {"admitted_cheap": 0, "admitted_expensive": 0, "rate_limited": 0,
+                         "shed_cheap": 0, "shed_expensive": 0}
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _take_token(self, client, now):
+        # returns 0 when a token was taken, otherwise the seconds until there is one
+        tokens, last = self._buckets.pop(client, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self._buckets[client] = (tokens, now)
+        if len(self._buckets) > MAX_CLIENTS:
+            self._buckets.popitem(last=False)
+        return wait
+
+    def _admit(self, environ):
+        # None when admitted, otherwise the rejection as (status, Retry-After, message)
+        cheap = self.is_cheap(environ)
+        with self._lock:
+            if self.rate > 0:
+                wait = self._take_token(environ.get("REMOTE_ADDR", ""), time.monotonic())
+                if wait:
+                    self.counters["rate_limited"] += 1
+                    return "429 Too Many Requests", math.ceil(wait), "Womp womp, too many requests"
+            if self.max_concurrency > 0:
+                if self.in_flight >= self.max_concurrency or (not cheap and self.expensive_in_flight >= self.max_expensive):
+                    self.counters["shed_cheap" if cheap else "shed_expensive"] += 1
+                    return "503 Service Unavailable", 1, "Womp womp, the server is busy, try again"
+            self.in_flight += 1
+            self.expensive_in_flight += not cheap
+            self.counters["admitted_cheap" if cheap else "admitted_expensive"] += 1
+        environ["admission.cheap"] = cheap
+        return None
+
+    def _release(self, cheap):
+        with self._lock:
+            self.in_flight -= 1
+            self.expensive_in_flight -= not cheap
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO", "") in self.exempt:
+            return self.wsgi_app(environ, start_response)
+        rejection = self._admit(environ)
+        if rejection is not None:
+            status, retry_after, message = rejection
+            body = ('{"msg":"%s"}\n' % message).encode()
+            start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body))),
+                                    ("Retry-After", str(retry_after)), ("Access-Control-Allow-Origin", "*")])
+            return [body]
+        cheap = environ["admission.cheap"]
+        try:
+            response = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self._release(cheap)
+            raise
+        # the slot is held until the body has been sent, streamed dumps included
+        return ReleasingIterable(response, lambda: self._release(cheap))
+
+
+class ReleasingIterable:
+    def __init__(self, response, release):
+        self.response = response
+        self.release = release
+
+    def __iter__(self):
+        return iter(self.response)
+
+    def close(self):
+        try:
+            if hasattr(self.response, "close"):
+                self.response.close()
+        finally:
+            self.release()
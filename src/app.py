@@ -2,334 +2,525 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import re
+import hashlib
+import threading
+import click
+from flask import Flask, Blueprint, current_app, request, jsonify, url_for, stream_with_context, abort, make_response
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.wrappers import Request
 from utils import APIException, generate_sitemap
-from admin import setup_admin
-from sqlalchemy import select
-from models import db, User, Characters, Planets, Films, Vehicles, Species, Favorites_characters, Favorites_planets, Favorites_films, Favorites_vehicles, Favorites_species
+from cache import catalog_cache
+from metrics import Metrics
+from replicas import Replicas, read_only
+from admission import AdmissionControl
+from database import engine_options, pool_status
+from search import search
+import counters
+from serialization import FastJSONProvider
+import compression
+from resources import RESOURCES, CATALOG
+from queries import list_statement, list_payload, detail_payload, favorites_statement, favorites_payload
+from sqlalchemy import select, insert, delete, literal
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Favorites
 # from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
-        "postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+# every route of the API, registered on the app by create_app()
+api = Blueprint("api", __name__, cli_group=None)
 
 # Handle/serialize errors like a JSON object
 
 
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+
+@api.app_errorhandler(IntegrityError)
+def handle_integrity_error(error):
+    # duplicated names/favorites hit the unique constraints instead of failing with a 500
+    db.session.rollback()
+    return jsonify({"msg": "This record already exists"}), 409
+
 # generate sitemap with all your endpoints
 
 
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
-
-
-@app.route('/<case>', methods=['GET', 'POST'])
-def handle_cases(case):
-    response_body = ""
-    if request.method == "GET":
-        match case:
-            case "planets":
-                planets = db.session.execute(select(Planets)).scalars().all()
-                response_body = {
-                    "planets": list(map(lambda planets: planets.serialize(), planets))
-                }, 200
-            case "characters":
-                characters = db.session.execute(
-                    select(Characters)).scalars().all()
-                response_body = {
-                    "characters": list(map(lambda characters: characters.serialize(), characters))
-                }, 200
-            case "films":
-                films = db.session.execute(select(Films)).scalars().all()
-                response_body = {
-                    "films": list(map(lambda films: films.serialize(), films))
-                }, 200
-            case "vehicles":
-                vehicles = db.session.execute(select(Vehicles)).scalars().all()
-                response_body = {
-                    "vehicles": list(map(lambda vehicles: vehicles.serialize(), vehicles))
-                }, 200
-            case "species":
-                species = db.session.execute(select(Species)).scalars().all()
-                response_body = {
-                    "species": list(map(lambda species: species.serialize(), species))
-                }, 200
-            case "users":
-                users = db.session.execute(select(User)).scalars().all()
-                response_body = {
-                    "users": list(map(lambda users: users.serialize(), users))
-                }, 200
-            case _:
-                response_body = {
-                    "Operation not found"
-                }, 400
+    return generate_sitemap(current_app)
+
+
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(catalog_cache.stats()), 200
+
+
+@api.route('/search', methods=['GET'])
+@read_only
+def search_catalog():
+    # ?q=<words>&limit=<n>&offset=<n>, ranked matches across every catalog table
+    q = request.args.get('q', '').strip()
+    if not q:
+        raise APIException('q is required', status_code=400)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    rows = search(db.session, q, limit + 1, offset)
+    return jsonify({
+        "results": [{
+            "kind": row.kind,
+            "id": row.id,
+            "name": row.name,
+            "imageLink": row.imageLink,
+            "rank": row.rank
+        } for row in rows[:limit]],
+        "next": offset + limit if len(rows) > limit else None
+    }), 200
+
+
+# catalog responses may be kept by shared caches/CDNs, per user responses only revalidated
+PUBLIC_CACHE_CONTROL = "public, max-age=" + os.getenv("HTTP_CACHE_MAX_AGE", "60")
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+
+def cached_json(key, build, cache_control=PUBLIC_CACHE_CONTROL):
+    # The encoded body is cached together with its ETag, so a hit skips the query and the
+    # serialization, and a matching If-None-Match is answered with an empty 304.
+    # The tag is a hash of the body rather than an in-process write counter, so every
+    # gunicorn worker hands out the same tag for the same content.
+    entry = catalog_cache.get(key)
+    if entry is None:
+        body = current_app.json.response(build()).get_data()
+        entry = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        catalog_cache.set(key, entry)
+    # Each encoding is a different representation and gets its own ETag, its compressed
+    # bytes are cached as well so a body is compressed once per version.
+    body, etag = entry
+    encoding = compression.negotiate(request.accept_encodings, len(body))
+    tag = etag + "-" + encoding if encoding else etag
+    if request.if_none_match.contains(tag):
+        response = current_app.response_class(status=304)
+    elif encoding:
+        response = current_app.response_class(compression.cached_variant(catalog_cache, key, body, etag, encoding),
+                                              mimetype=current_app.json.mimetype)
+        response.headers["Content-Encoding"] = encoding
     else:
-        request_body = request.json
-        match case:
-            case "planets":
-                planet = Planets(**request_body)
-                db.session.add(planet)
-                db.session.commit()
-                response_body = {
-                    "planet": planet.name + " Has been added"
-                }, 200
-            case "characters":
-                character = Characters(**request_body)
-                db.session.add(character)
-                db.session.commit()
-                response_body = {
-                    "character": character.name + " Has been added"
-                }, 200
-            case "films":
-                film = Films(**request_body)
-                db.session.add(film)
-                db.session.commit()
-                response_body = {
-                    "film": film.title + " Has been added"
-                }, 200
-            case "vehicles":
-                vehicle = Vehicles(**request_body)
-                db.session.add(vehicle)
-                db.session.commit()
-                response_body = {
-                    "vehicle": vehicle.name + " Has been added"
-                }, 200
-            case "species":
-                species = Species(**request_body)
-                db.session.add(species)
-                db.session.commit()
-                response_body = {
-                    "species": species.name + " Has been added"
-                }, 200
-            case _:
-                response_body = {
-                    "Operation not found"
-                }, 200
-
-    return jsonify(response_body)
-
-
-@app.route('/users/<int:user_id>/favorites', methods=['GET'])
-def user_favorites(user_id):
+        response = current_app.response_class(body, mimetype=current_app.json.mimetype)
+    response.set_etag(tag)
+    response.headers["Cache-Control"] = cache_control
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def wants_stream():
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best == "application/x-ndjson"
+
+
+def stream_rows(resource):
+    # yield_per makes the driver use a server side cursor (where supported) and only
+    # buffers one batch of plain column tuples at a time, so memory stays flat.
+    names = resource.fields
+    stmt = resource.stream.execution_options(yield_per=1000)
+
+    def generate():
+        for row in db.session.execute(stmt):
+            yield current_app.json.dumps(dict(zip(names, row))) + "\n"
+
+    return current_app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def is_bulk_request():
+    return request.mimetype == "application/x-ndjson" or isinstance(request.get_json(silent=True), list)
+
+
+def read_bulk_rows():
+    # a JSON array, or one JSON object per line for application/x-ndjson bodies
+    if request.mimetype != "application/x-ndjson":
+        return list(enumerate(request.json))
+    rows = []
+    for index, line in enumerate(request.get_data(as_text=True).splitlines()):
+        if not line.strip():
+            continue
+        try:
+            rows.append((index, current_app.json.loads(line)))
+        except ValueError:
+            rows.append((index, None))
+    return rows
+
+
+def validate_row(model, row):
+    columns = model.__table__.columns
+    if not isinstance(row, dict):
+        return "Each row must be a JSON object"
+    unknown = [key for key in row if key not in columns or key == "id"]
+    if unknown:
+        return "Unknown fields: " + ", ".join(unknown)
+    missing = [column.key for column in columns
+               if not column.primary_key and not column.nullable and row.get(column.key) is None]
+    if missing:
+        return "Missing fields: " + ", ".join(missing)
+    if not all(isinstance(value, str) for value in row.values()):
+        return "All fields must be strings"
+    return None
+
+
+def bulk_insert(resource):
+    # Rows are validated and checked for unique name/title conflicts one batch at a time,
+    # then each batch is written with a single executemany INSERT and one commit.
+    model = resource.model
+    unique = resource.display
+    batch_size = max(1, request.args.get("batch_size", int(os.getenv("BULK_BATCH_SIZE", 1000)), type=int))
+    rows = read_bulk_rows()
+    inserted = 0
+    errors = []
+    seen = set()
+
+    for start in range(0, len(rows), batch_size):
+        batch = []
+        for index, row in rows[start:start + batch_size]:
+            error = validate_row(model, row)
+            if error is None and row[unique.key] in seen:
+                error = "Duplicated " + unique.key + " in this load"
+            if error is not None:
+                errors.append({"index": index, "error": error})
+                continue
+            seen.add(row[unique.key])
+            batch.append((index, row))
+        if not batch:
+            continue
+
+        taken = set(db.session.execute(
+            select(unique).where(unique.in_([row[unique.key] for index, row in batch]))).scalars())
+        for index, row in batch:
+            if row[unique.key] in taken:
+                errors.append({"index": index, "error": unique.key + " already exists"})
+        batch = [(index, row) for index, row in batch if row[unique.key] not in taken]
+        if not batch:
+            continue
+
+        try:
+            db.session.execute(insert(model), [row for index, row in batch])
+            db.session.commit()
+            inserted += len(batch)
+        except IntegrityError:
+            # somebody inserted one of these names meanwhile, fall back to row by row
+            db.session.rollback()
+            for index, row in batch:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(insert(model), [row])
+                    inserted += 1
+                except IntegrityError:
+                    errors.append({"index": index, "error": unique.key + " already exists"})
+            db.session.commit()
+
+    catalog_cache.invalidate(resource.name)
+    return jsonify({"inserted": inserted, "errors": errors}), 200
+
+
+def list_case(resource):
+    names, stmt = list_statement(resource, request.args)
+    return list_payload(resource, request.args, names, db.session.execute(stmt).all())
+
+
+@read_only
+def list_resource(case):
+    resource = RESOURCES[case]
+    if wants_stream():
+        return stream_rows(resource)
+    if resource.catalog:
+        return cached_json((case, "list") + tuple(sorted(request.args.items(multi=True))),
+                           lambda: list_case(resource))
+    return jsonify(list_case(resource)), 200
+
+
+def create_resource(case):
+    resource = CATALOG[case]
+    if is_bulk_request():
+        return bulk_insert(resource)
+    error = validate_row(resource.model, request.json)
+    if error is not None:
+        raise APIException(error, status_code=400)
+    entry = resource.model(**request.json)
+    db.session.add(entry)
+    db.session.commit()
+    catalog_cache.invalidate(case)
+    return jsonify({resource.key: getattr(entry, resource.display.key) + " Has been added"}), 200
+
+
+def get_case(resource, case_id):
+    row = db.session.execute(resource.detail, {"entity_id": case_id}).first()
+    if row is None:
+        abort(make_response(jsonify({"msg": "Womp womp, nothing found"}), 404))
+    return detail_payload(resource, row)
+
+
+@read_only
+def get_resource(case, case_id):
+    resource = CATALOG[case]
+    return cached_json((case, case_id), lambda: get_case(resource, case_id))
+
+
+def favorites_body(user_id, expand):
     user = db.session.get(User, user_id)
     if not user:
+        abort(make_response(jsonify({"msg": "Womp womp, no user found"}), 404))
+    rows = db.session.execute(favorites_statement(expand), {"user_id": user_id})
+    return favorites_payload(user.username, rows, expand)
+
+
+@api.route('/users/<int:user_id>/favorites', methods=['GET'])
+@read_only
+def user_favorites(user_id):
+    expand = request.args.get('expand') in ('1', 'true')
+    return cached_json(("favorites", user_id, expand), lambda: favorites_body(user_id, expand),
+                       PRIVATE_CACHE_CONTROL)
+
+
+def insert_ignore(model):
+    # INSERT that skips rows hitting a unique constraint instead of failing the statement
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return insert(model).prefix_with("IGNORE")
+
+
+@api.route('/users/<int:user_id>/favorites', methods=['POST'])
+def batch_favorites(user_id):
+    # Body: [{"op": "add" | "remove", "kind": "planets", "id": 3}, ...]. The last operation
+    # on a favorite wins, then every kind costs at most one INSERT ... SELECT (which skips
+    # existing favorites and unknown ids) and one DELETE ... IN, all in one transaction.
+    if db.session.get(User, user_id) is None:
         return jsonify({"msg": "Womp womp, no user found"}), 404
+    operations = request.json
+    if not isinstance(operations, list):
+        raise APIException("Expected a list of operations", status_code=400)
 
-    favorite_planets = db.session.execute(
-        select(Favorites_planets).where(Favorites_planets.user_id == user_id)
-    ).scalars().all()
+    errors = []
+    wanted = {}
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("op") not in ("add", "remove"):
+            errors.append({"index": index, "error": "op must be add or remove"})
+        elif operation.get("kind") not in CATALOG:
+            errors.append({"index": index, "error": "Unknown kind"})
+        elif not isinstance(operation.get("id"), int) or isinstance(operation.get("id"), bool):
+            errors.append({"index": index, "error": "id must be an integer"})
+        else:
+            wanted[(operation["kind"], operation["id"])] = operation["op"]
 
-    favorite_characters = db.session.execute(
-        select(Favorites_characters).where(
-            Favorites_characters.user_id == user_id)
-    ).scalars().all()
+    added = {}
+    removed = {}
+    changes = counters.Changes(db.session)
+    for kind, resource in CATALOG.items():
+        entity = resource.model
+        add_ids = [case_id for (key, case_id), op in wanted.items() if key == kind and op == "add"]
+        remove_ids = [case_id for (key, case_id), op in wanted.items() if key == kind and op == "remove"]
+        if add_ids:
+            stmt = insert_ignore(Favorites).from_select(
+                [Favorites.user_id, Favorites.kind, Favorites.entity_id],
+                select(literal(user_id), literal(resource.code), entity.id).where(entity.id.in_(add_ids)))
+            added[kind] = changes.apply(resource, stmt, add_ids, 1)
+        if remove_ids:
+            stmt = delete(Favorites).where(Favorites.user_id == user_id, Favorites.kind == resource.code,
+                                           Favorites.entity_id.in_(remove_ids))
+            removed[kind] = changes.apply(resource, stmt, remove_ids, -1)
+    changes.flush()
+    db.session.commit()
+    catalog_cache.invalidate("favorites", user_id)
+    for kind in set(added) | set(removed):
+        catalog_cache.invalidate(kind, "top")
 
-    favorite_films = db.session.execute(
-        select(Favorites_films).where(Favorites_films.user_id == user_id)
-    ).scalars().all()
+    return jsonify({"added": added, "removed": removed, "errors": errors}), 200
 
-    favorite_vehicles = db.session.execute(
-        select(Favorites_vehicles).where(Favorites_vehicles.user_id == user_id)
-    ).scalars().all()
 
-    favorite_species = db.session.execute(
-        select(Favorites_species).where(Favorites_species.user_id == user_id)
-    ).scalars().all()
+def add_favorite(user_id, case, case_id):
+    resource = CATALOG[case]
+    if db.session.get(User, user_id) is None:
+        return jsonify({"msg": "Womp womp, no user found"}), 404
+    display = db.session.execute(resource.display_by_id, {"entity_id": case_id}).scalar_one_or_none()
+    if display is None:
+        return jsonify({"msg": "Womp womp, nothing found"}), 404
+    db.session.execute(insert(Favorites), {"user_id": user_id, "kind": resource.code, "entity_id": case_id})
+    counters.add(db.session, resource, case_id, 1)
+    db.session.commit()
+    catalog_cache.invalidate("favorites", user_id)
+    catalog_cache.invalidate(case, "top")
+    return jsonify({resource.key: display + " Has been added to favorites"}), 200
+
+
+def remove_favorite(user_id, case, case_id):
+    # a single DELETE of one favorites primary key, its rowcount tells whether the
+    # favorite existed
+    resource = CATALOG[case]
+    removed = db.session.execute(resource.remove_favorite, {"user_id": user_id, "entity_id": case_id}).rowcount
+    if not removed:
+        db.session.rollback()
+        return jsonify({"msg": "Womp womp, that favorite does not exist"}), 404
+    counters.add(db.session, resource, case_id, -1)
+    # the response names the entry, as it always did ({"planet": "Tatooine Has been...})
+    display = db.session.execute(resource.display_by_id, {"entity_id": case_id}).scalar_one_or_none()
+    db.session.commit()
+    catalog_cache.invalidate("favorites", user_id)
+    catalog_cache.invalidate(case, "top")
+    return jsonify({resource.key: (display or str(case_id)) + " Has been deleted from favorites"}), 200
 
-    return jsonify({
-        "username": user.username,
-        "favorite planets": list(map(lambda favorite_planets: favorite_planets.serialize(), favorite_planets)),
-        "favorite characters": list(map(lambda favorite_characters: favorite_characters.serialize(), favorite_characters)),
-        "favorite films": list(map(lambda favorite_films: favorite_films.serialize(), favorite_films)),
-        "favorite vehicles": list(map(lambda favorite_vehicles: favorite_vehicles.serialize(), favorite_vehicles)),
-        "favorite species": list(map(lambda favorite_species: favorite_species.serialize(), favorite_species))
-    }), 200
 
+def top_body(resource, limit):
+    rows = db.session.execute(resource.top, {"limit": limit})
+    return {resource.name: [{
+        "id": row.id,
+        resource.display.key: row.display,
+        "imageLink": row.imageLink,
+        "favorites": row.count
+    } for row in rows]}
 
-@app.route('/<case>/<int:case_id>', methods=['GET'])
-def handle_cases_singular(case, case_id):
-    match case:
-        case "planets":
-            planet = db.session.execute(select(Planets).where(
-                Planets.id == case_id)).scalar_one_or_none()
-            response_body = {
-                "planet": planet.serialize()
-            }, 200
-        case "characters":
-            character = db.session.execute(select(Characters).where(
-                Characters.id == case_id)).scalar_one_or_none()
-            response_body = {
-                "character": character.serialize()
-            }, 200
-        case "films":
-            film = db.session.execute(select(Films).where(
-                Films.id == case_id)).scalar_one_or_none()
-            response_body = {
-                "film": film.serialize()
-            }, 200
-        case "vehicles":
-            vehicle = db.session.execute(select(Vehicles).where(
-                Vehicles.id == case_id)).scalar_one_or_none()
-            response_body = {
-                "vehicle": vehicle.serialize()
-            }
-        case "species":
-            species = db.session.execute(select(Species).where(
-                Species.id == case_id)).scalar_one_or_none()
-            response_body = {
-                "species": species.serialize()
-            }, 200
-        case _:
-            response_body = {
-                "Operation not found"
-            }, 400
-
-    return jsonify(response_body)
-
-
-@app.route('/favorite/<int:user_id>/<case>/<int:case_id>', methods=['POST', 'DELETE'])
-def handle_favorites(user_id, case, case_id):
-    response_body = ""
-    if request.method == "DELETE":
-        user = db.session.execute(select(User).where(
-            User.id == user_id)).scalar_one_or_none()
-        match case:
-            case "planets":
-                planet = db.session.execute(select(Planets).where(
-                    Planets.id == case_id)).scalar_one_or_none()
-                favorite_planet = Favorites_planets(
-                    planets_id=planet.id, user_id=user.id)
-                db.session.delete(favorite_planet)
-                db.session.commit()
-                response_body = {
-                    "planet": planet.name + " Has been deleted from favorites"
-                }, 200
-            case "characters":
-                character = db.session.execute(select(Characters).where(
-                    Characters.id == case_id)).scalar_one_or_none()
-                favorite_character = Favorites_characters(
-                    character_id=character.id, user_id=user.id)
-                db.session.delete(favorite_character)
-                db.session.commit()
-                response_body = {
-                    "character": character.name + " Has been deleted from favorites"
-                }, 200
-            case "films":
-                film = db.session.execute(select(Films).where(
-                    Films.id == case_id)).scalar_one_or_none()
-                favorite_film = Favorites_films(
-                    films_id=film.id, user_id=user.id)
-                db.session.delete(favorite_film)
-                db.session.commit()
-                response_body = {
-                    "film": film.title + " Has been deleted from favorites"
-                }, 200
-            case "vehicles":
-                vehicle = db.session.execute(select(Vehicles).where(
-                    Vehicles.id == case_id)).scalar_one_or_none()
-                favorite_vehicle = Favorites_vehicles(
-                    vehicles_id=vehicle.id, user_id=user.id)
-                db.session.delete(favorite_vehicle)
-                db.session.commit()
-                response_body = {
-                    "vehicle": vehicle.name + " Has been deleted from favorites"
-                }, 200
-            case "species":
-                species = db.session.execute(select(Species).where(
-                    Species.id == case_id)).scalar_one_or_none()
-                favorite_species = Favorites_species(
-                    species_id=species.id, user_id=user.id)
-                db.session.delete(favorite_species)
-                db.session.commit()
-                response_body = {
-                    "species": species.name + " Has been deleted from favorites"
-                }, 200
-            case _:
-                response_body = {
-                    "Operation not found"
-                }, 400
+
+@read_only
+def top_resource(case):
+    # ?limit=<n> most favorited entries, read from the favorite_counts leaderboard index
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    return cached_json((case, "top", limit), lambda: top_body(CATALOG[case], limit))
+
+
+@api.cli.command("rebuild-favorite-counts")
+def rebuild_favorite_counts():
+    """Count every favorite again into favorite_counts."""
+    counters.rebuild(db.session)
+    db.session.commit()
+
+
+# every resource gets its routes from the registry, the view finds it with one dict lookup
+for name, resource in RESOURCES.items():
+    api.add_url_rule('/' + name, 'list_resource', list_resource, defaults={"case": name}, methods=['GET'])
+    if resource.catalog:
+        api.add_url_rule('/' + name, 'create_resource', create_resource, defaults={"case": name}, methods=['POST'])
+        api.add_url_rule('/' + name + '/<int:case_id>', 'get_resource', get_resource, defaults={"case": name},
+                         methods=['GET'])
+        api.add_url_rule('/' + name + '/top', 'top_resource', top_resource, defaults={"case": name}, methods=['GET'])
+        api.add_url_rule('/favorite/<int:user_id>/' + name + '/<int:case_id>', 'add_favorite', add_favorite,
+                         defaults={"case": name}, methods=['POST'])
+        api.add_url_rule('/favorite/<int:user_id>/' + name + '/<int:case_id>', 'remove_favorite', remove_favorite,
+                         defaults={"case": name}, methods=['DELETE'])
+
+
+class AdminMount:
+    """WSGI middleware serving /admin from a second app that is only built, and
+    Flask-Admin only imported, on the first request under /admin. Flask does not let
+    views be added to the API app once it has served a request, hence the second app.
+    """
+
+    def __init__(self, app):
+        self.config = app.config
+        self.wsgi_app = app.wsgi_app
+        self.admin_app = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        from admin import setup_admin
+        admin_app = Flask(__name__)
+        admin_app.config.update(self.config)
+        # its own engine, a small pool is plenty for the people using the admin
+        options = dict(self.config['SQLALCHEMY_ENGINE_OPTIONS'])
+        if "pool_size" in options:
+            options.update(pool_size=1, max_overflow=1)
+        admin_app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        db.init_app(admin_app)
+        setup_admin(admin_app)
+        return admin_app
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if path != "/admin" and not path.startswith("/admin/"):
+            return self.wsgi_app(environ, start_response)
+        with self._lock:
+            if self.admin_app is None:
+                self.admin_app = self.build()
+        return self.admin_app(environ, start_response)
+
+
+CHEAP_PATH = re.compile(r"^/(\w+)(?:/(?:\d+|top))?/?$")
+
+
+def is_cheap(environ):
+    """Catalog reads, served from the response cache most of the time: pages (not the
+    streamed dumps), details and leaderboards. Everything else counts as expensive."""
+    if environ.get("REQUEST_METHOD") not in ("GET", "HEAD"):
+        return False
+    match = CHEAP_PATH.match(environ.get("PATH_INFO", ""))
+    if match is None or match.group(1) not in CATALOG:
+        return False
+    request = Request(environ)
+    return request.args.get('stream') not in ('1', 'true') and request.accept_mimetypes.best != "application/x-ndjson"
+
+
+def create_app(serve_only=False):
+    """Builds the API app. `serve_only` leaves the admin out, otherwise it is built on
+    its first request (see AdminMount). Flask-Migrate, and with it Alembic, is only
+    loaded when the flask command loads the app, its db commands being its only use.
+    """
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    app.json = FastJSONProvider(app)
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace(
+            "postgres://", "postgresql://")
     else:
-        user = db.session.execute(select(User).where(
-            User.id == user_id)).scalar_one_or_none()
-        match case:
-            case "planets":
-                planet = db.session.execute(select(Planets).where(
-                    Planets.id == case_id)).scalar_one_or_none()
-                favorite_planet = Favorites_planets(
-                    planets_id=planet.id, user_id=user.id)
-                db.session.add(favorite_planet)
-                db.session.commit()
-                response_body = {
-                    "planet": planet.name + " Has been added to favorites"
-                }, 200
-            case "characters":
-                character = db.session.execute(select(Characters).where(
-                    Characters.id == case_id)).scalar_one_or_none()
-                favorite_character = Favorites_characters(
-                    character_id=character.id, user_id=user.id)
-                db.session.add(favorite_character)
-                db.session.commit()
-                response_body = {
-                    "character": character.name + " Has been added to favorites"
-                }, 200
-            case "films":
-                film = db.session.execute(select(Films).where(
-                    Films.id == case_id)).scalar_one_or_none()
-                favorite_film = Favorites_films(
-                    films_id=film.id, user_id=user.id)
-                db.session.add(favorite_film)
-                db.session.commit()
-                response_body = {
-                    "film": film.title + " Has been added to favorites"
-                }, 200
-            case "vehicles":
-                vehicle = db.session.execute(select(Vehicles).where(
-                    Vehicles.id == case_id)).scalar_one_or_none()
-                favorite_vehicle = Favorites_vehicles(
-                    vehicles_id=vehicle.id, user_id=user.id)
-                db.session.add(favorite_vehicle)
-                db.session.commit()
-                response_body = {
-                    "vehicle": vehicle.name + " Has been added to favorites"
-                }, 200
-            case "species":
-                species = db.session.execute(select(Species).where(
-                    Species.id == case_id)).scalar_one_or_none()
-                favorite_species = Favorites_species(
-                    species_id=species.id, user_id=user.id)
-                db.session.add(favorite_species)
-                db.session.commit()
-                response_body = {
-                    "species": species.name + " Has been added to favorites"
-                }, 200
-            case _:
-                response_body = {
-                    "Operation not found"
-                }, 400
-    return jsonify(response_body)
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    db.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    CORS(app)
+    if not serve_only:
+        app.wsgi_app = AdminMount(app)
+    admission = AdmissionControl(app, is_cheap)
+    app.wsgi_app = admission
+    proxy_hops = int(os.getenv("PROXY_HOPS", 0))
+    if proxy_hops:
+        # REMOTE_ADDR from X-Forwarded-For, so the rate limits apply to the real clients
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxy_hops)
+    metrics = Metrics(app)
+    metrics.register("api_cache_hits_total", "counter", "Catalog cache hits", lambda: catalog_cache.hits)
+    metrics.register("api_cache_misses_total", "counter", "Catalog cache misses", lambda: catalog_cache.misses)
+    for pool_counter in ("size", "checkedin", "checkedout", "overflow"):
+        metrics.register("db_pool_" + pool_counter, "gauge", "Connection pool " + pool_counter + " of this worker",
+                         lambda counter=pool_counter: pool_status(db.engine).get(counter, 0))
+    for counter, help_text in (("admitted_cheap", "Cheap requests admitted"),
+                               ("admitted_expensive", "Expensive requests admitted"),
+                               ("rate_limited", "Requests refused with 429 (client over its rate limit)"),
+                               ("shed_cheap", "Cheap requests refused with 503 (worker at capacity)"),
+                               ("shed_expensive", "Expensive requests refused with 503 (expensive share used up)")):
+        metrics.register("api_admission_" + counter + "_total", "counter", help_text,
+                         lambda counter=counter: admission.counters[counter])
+    metrics.register("api_admission_in_flight", "gauge", "Requests this worker is handling",
+                     lambda: admission.in_flight)
+    replicas = Replicas(app)
+    if replicas.replicas:
+        metrics.register("db_replicas_healthy", "gauge", "Read replicas passing their health checks",
+                         replicas.healthy_count)
+        metrics.register("db_replica_reads_total", "counter", "Read-only requests served by a replica",
+                         lambda: sum(replica.reads for replica in replicas.replicas))
+        metrics.register("db_replica_primary_reads_total", "counter",
+                         "Read-only requests sent to the primary (after a write or with no healthy replica)",
+                         lambda: replicas.primary_reads)
+    # registered after Metrics, so the response sizes it records are the compressed ones
+    compression.init_app(app)
+    app.register_blueprint(api)
+    return app
 
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
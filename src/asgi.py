@@ -0,0 +1,219 @@
+"""
+ASGI entry point. The read endpoints (catalog lists and details, user favorites) are
+served natively on an async engine (aiosqlite locally, asyncpg on Postgres), so one
+process keeps answering while hundreds of slow clients or queries are in flight.
+Every other route is handed to the Flask app in a worker thread. With
+DATABASE_REPLICA_URLS set the native reads go to a replica, chosen and fenced like the
+@read_only views of the Flask app (see replicas.py).
+
+    uvicorn asgi:application --app-dir src --port 3000
+"""
+import asyncio
+import hashlib
+import re
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from werkzeug.datastructures import MIMEAccept, MultiDict
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from app import create_app, PUBLIC_CACHE_CONTROL, PRIVATE_CACHE_CONTROL
+from cache import catalog_cache, LRUCache
+import compression
+from database import async_database_uri, engine_options, env_flag
+from models import User
+from queries import list_statement, list_payload, detail_payload, favorites_statement, favorites_payload
+from resources import RESOURCES, CATALOG
+from utils import APIException
+
+app = create_app(serve_only=env_flag("SERVE_ONLY", "false"))
+async_uri = async_database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(async_uri, **engine_options(async_uri))
+Session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+replicas = app.extensions["replicas"]
+# an async engine on every replica, counted and checked like its sync one
+replica_engines = []
+replica_sessions = {}
+for replica in replicas.replicas:
+    replica_uri = async_database_uri(replica.engine.url.render_as_string(hide_password=False), primary=False)
+    replica_engine = create_async_engine(replica_uri, **engine_options(replica_uri))
+    replicas.watch(replica, replica_engine.sync_engine)
+    replica_engines.append(replica_engine)
+    replica_sessions[replica] = async_sessionmaker(replica_engine, class_=AsyncSession, expire_on_commit=False)
+
+flask_app = WsgiToAsgi(app)
+
+LIST_ROUTE = re.compile(r"^/(\w+)/?$")
+DETAIL_ROUTE = re.compile(r"^/(\w+)/(\d+)/?$")
+FAVORITES_ROUTE = re.compile(r"^/users/(\d+)/favorites/?$")
+
+
+class NotFound(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+class Request:
+    def __init__(self, scope):
+        self.path = scope["path"]
+        self.args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+        self.headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+
+    def wants_stream(self):
+        if self.args.get("stream") in ("1", "true"):
+            return True
+        return parse_accept_header(self.headers.get("accept"), MIMEAccept).best == "application/x-ndjson"
+
+    @property
+    def accept_encodings(self):
+        return parse_accept_header(self.headers.get("accept-encoding"))
+
+
+def encode(payload):
+    # the Flask JSON provider, so bodies are byte for byte what jsonify() returns
+    return app.json.response(payload).get_data()
+
+
+async def off_loop(function, *args):
+    # the shared caches block (a SQLite file with its busy timeout, a Redis round trip),
+    # so they are called from a worker thread and the loop keeps serving the other
+    # requests; the in-process LRU is only a dict lookup
+    if isinstance(catalog_cache, LRUCache):
+        return function(*args)
+    return await asyncio.to_thread(function, *args)
+
+
+async def cached_json(request, key, build, cache_control=PUBLIC_CACHE_CONTROL):
+    # same entries and ETags as cached_json() in app.py, both apps share catalog_cache
+    entry = await off_loop(catalog_cache.get, key)
+    if entry is None:
+        body = encode(await build())
+        entry = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        await off_loop(catalog_cache.set, key, entry)
+    body, etag = entry
+    encoding = compression.negotiate(request.accept_encodings, len(body))
+    tag = etag + "-" + encoding if encoding else etag
+    headers = [("ETag", quote_etag(tag)), ("Cache-Control", cache_control), ("Vary", "Accept-Encoding")]
+    if parse_etags(request.headers.get("if-none-match")).contains(tag):
+        return 304, headers, b""
+    if encoding:
+        body = await off_loop(compression.cached_variant, catalog_cache, key, body, etag, encoding)
+        headers.append(("Content-Encoding", encoding))
+    return 200, headers, body
+
+
+async def uncached_json(request, build):
+    body = encode(await build())
+    encoding = compression.negotiate(request.accept_encodings, len(body))
+    headers = [("Vary", "Accept-Encoding")] if len(body) >= compression.MIN_SIZE else []
+    if encoding:
+        body = compression.compress(body, encoding)
+        headers.append(("Content-Encoding", encoding))
+    return 200, headers, body
+
+
+async def read_session():
+    # a replica unless none is healthy or a write fenced the primary, choose() may read
+    # the fence from a shared cache so it runs off the loop
+    if not replicas.replicas:
+        return Session()
+    replica = await asyncio.to_thread(replicas.choose)
+    return Session() if replica is None else replica_sessions[replica]()
+
+
+async def list_case(resource, args):
+    names, stmt = list_statement(resource, args)
+    async with await read_session() as session:
+        rows = (await session.execute(stmt)).all()
+    return list_payload(resource, args, names, rows)
+
+
+async def get_case(resource, case_id):
+    async with await read_session() as session:
+        row = (await session.execute(resource.detail, {"entity_id": case_id})).first()
+    if row is None:
+        raise NotFound("Womp womp, nothing found")
+    return detail_payload(resource, row)
+
+
+async def favorites_body(user_id, expand):
+    async with await read_session() as session:
+        username = (await session.execute(select(User.username).where(User.id == user_id))).scalar_one_or_none()
+        if username is None:
+            raise NotFound("Womp womp, no user found")
+        rows = (await session.execute(favorites_statement(expand), {"user_id": user_id})).all()
+    return favorites_payload(username, rows, expand)
+
+
+def route(request):
+    """The native handler for this request, or None when Flask should serve it."""
+    match = FAVORITES_ROUTE.match(request.path)
+    if match:
+        user_id = int(match.group(1))
+        expand = request.args.get("expand") in ("1", "true")
+        return lambda: cached_json(request, ("favorites", user_id, expand),
+                                   lambda: favorites_body(user_id, expand), PRIVATE_CACHE_CONTROL)
+    match = DETAIL_ROUTE.match(request.path)
+    if match and match.group(1) in CATALOG:
+        resource, case_id = CATALOG[match.group(1)], int(match.group(2))
+        return lambda: cached_json(request, (resource.name, case_id), lambda: get_case(resource, case_id))
+    match = LIST_ROUTE.match(request.path)
+    if match and match.group(1) in RESOURCES and not request.wants_stream():
+        resource = RESOURCES[match.group(1)]
+        if resource.catalog:
+            key = (resource.name, "list") + tuple(sorted(request.args.items(multi=True)))
+            return lambda: cached_json(request, key, lambda: list_case(resource, request.args))
+        return lambda: uncached_json(request, lambda: list_case(resource, request.args))
+    return None
+
+
+def cors_headers(request):
+    # what flask_cors sends with its default settings
+    origin = request.headers.get("origin")
+    if origin is None:
+        return [("Access-Control-Allow-Origin", "*")]
+    return [("Access-Control-Allow-Origin", origin), ("Vary", "Origin")]
+
+
+async def send_response(send, status, headers, body):
+    if status != 304:
+        headers = [("Content-Type", app.json.mimetype), ("Content-Length", str(len(body)))] + headers
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            for replica_engine in replica_engines:
+                await replica_engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    handler = None
+    if scope["type"] == "http" and scope["method"] == "GET":
+        request = Request(scope)
+        handler = route(request)
+    if handler is None:
+        return await flask_app(scope, receive, send)
+
+    try:
+        status, headers, body = await handler()
+    except APIException as error:
+        status, headers, body = error.status_code, [], encode(error.to_dict())
+    except NotFound as error:
+        status, headers, body = 404, [], encode({"msg": error.msg})
+    await send_response(send, status, headers + cors_headers(request), body)
@@ -0,0 +1,239 @@
+"""
+Response cache of the read endpoints. Entries are (body bytes, etag) pairs under tuple
+keys starting with the resource name ("planets", "favorites"...), so every entry under
+a key prefix can be dropped at once when it is written to.
+
+CACHE_URL picks where they live:
+    memory://                    this process only (default)
+    sqlite:////tmp/api_cache.db  a file shared by every worker on the host
+    redis://host:6379/0          a Redis server shared by every instance
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+def encode_key(key):
+    # a string whose prefixes are the encodings of the key's prefixes, for shared stores
+    return "".join(json.dumps(part, separators=(",", ":")) + "\x1f" for part in key)
+
+
+class LRUCache:
+    """Bounded least recently used cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, *prefix):
+        with self._lock:
+            for key in [key for key in self._data if key[:len(prefix)] == prefix]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl
+            }
+
+
+class SQLiteCache:
+    """Cache in a SQLite file, shared by the worker processes of one host.
+
+    WAL mode lets every worker read while another one writes. When the file is
+    full the entries closest to expiring go first, which keeps hits read-only.
+    Hit and miss counters are per process. `table` keeps several caches in one file.
+    """
+
+    def __init__(self, path, maxsize=1024, ttl=60, table="cache"):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # one connection per thread, opened again after gunicorn forks the worker
+        if getattr(self._local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, body BLOB NOT NULL, "
+                               "etag TEXT NOT NULL, expires REAL NOT NULL)" % self.table)
+            connection.execute("CREATE INDEX IF NOT EXISTS ix_{0}_expires ON {0} (expires)".format(self.table))
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return self._local.connection
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        row = self._connection().execute("SELECT body, etag FROM %s WHERE key = ? AND expires > ?" % self.table,
+                                         (encode_key(key), time.time())).fetchone()
+        self._count(row is not None)
+        return (bytes(row[0]), row[1]) if row is not None else None
+
+    def set(self, key, value):
+        body, etag = value
+        connection = self._connection()
+        connection.execute("INSERT OR REPLACE INTO %s (key, body, etag, expires) VALUES (?, ?, ?, ?)" % self.table,
+                           (encode_key(key), body, etag, time.time() + self.ttl))
+        connection.execute("DELETE FROM {0} WHERE key IN "
+                           "(SELECT key FROM {0} ORDER BY expires DESC LIMIT -1 OFFSET ?)".format(self.table),
+                           (self.maxsize,))
+
+    def invalidate(self, *prefix):
+        # every key under the prefix sorts between the prefix and the prefix with its
+        # last separator bumped, a range of the primary key index
+        start = encode_key(prefix)
+        self._connection().execute("DELETE FROM %s WHERE key >= ? AND key < ?" % self.table, (start, start[:-1] + "\x20"))
+
+    def clear(self):
+        self._connection().execute("DELETE FROM %s" % self.table)
+
+    def stats(self):
+        size = self._connection().execute("SELECT COUNT(*) FROM %s WHERE expires > ?" % self.table, (time.time(),)).fetchone()[0]
+        return {
+            "backend": "sqlite",
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl": self.ttl
+        }
+
+
+class RedisCache:
+    """Cache in Redis (or anything speaking its protocol), shared by every instance.
+
+    An entry is one value, the etag and the body separated by a newline, expiring
+    after `ttl`. Size is left to the server's maxmemory policy (allkeys-lru). So a
+    prefix can be dropped without SCAN, every key is also added to one set per
+    prefix of it. Hit and miss counters are per process.
+    """
+
+    def __init__(self, client, ttl=60, namespace="api-cache:"):
+        self.client = client
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _prefix_set(self, encoded_prefix):
+        return self.namespace + "prefix:" + encoded_prefix
+
+    def get(self, key):
+        value = self.client.get(self.namespace + encode_key(key))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        etag, body = value.split(b"\n", 1)
+        return body, etag.decode()
+
+    def set(self, key, value):
+        body, etag = value
+        encoded = encode_key(key)
+        ttl_ms = int(self.ttl * 1000)
+        # MULTI: the entry and its prefix sets appear at once to a concurrent invalidate()
+        pipe = self.client.pipeline(transaction=True)
+        pipe.set(self.namespace + encoded, etag.encode() + b"\n" + body, px=ttl_ms)
+        for length in range(1, len(key) + 1):
+            prefix_set = self._prefix_set(encode_key(key[:length]))
+            pipe.sadd(prefix_set, encoded)
+            pipe.pexpire(prefix_set, ttl_ms)
+        pipe.execute()
+
+    def invalidate(self, *prefix):
+        prefix_set = self._prefix_set(encode_key(prefix))
+
+        def drop(pipe):
+            keys = [self.namespace + member.decode() for member in pipe.smembers(prefix_set)]
+            pipe.multi()
+            pipe.delete(prefix_set, *keys)
+
+        # WATCH/MULTI: a set() under the prefix landing between SMEMBERS and DEL aborts
+        # the DEL and transaction() runs drop() again, so that entry is dropped as well
+        self.client.transaction(drop, prefix_set)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.namespace + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "ttl": self.ttl
+        }
+
+
+def cache_from_url(url, maxsize=1024, ttl=60, name="cache"):
+    # `name` tells apart caches sharing one CACHE_URL (a table in the SQLite file, a key
+    # namespace in Redis)
+    scheme = urlsplit(url).scheme
+    if scheme == "memory" or maxsize <= 0:
+        return LRUCache(maxsize=maxsize, ttl=ttl)
+    if scheme == "sqlite":
+        return SQLiteCache(url[len("sqlite:///"):], maxsize=maxsize, ttl=ttl, table=name)
+    if scheme in ("redis", "rediss", "unix"):
+        # imported here so the other backends do not pay the ~0.1 s it takes to import
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL=" + url + " needs the redis package")
+        return RedisCache(redis.Redis.from_url(url), ttl=ttl, namespace="api-" + name + ":")
+    raise ValueError("Unknown CACHE_URL scheme: " + scheme)
+
+
+catalog_cache = cache_from_url(os.getenv("CACHE_URL", "memory://"),
+                               maxsize=int(os.getenv("CACHE_MAXSIZE", 1024)),
+                               ttl=float(os.getenv("CACHE_TTL", 60)))
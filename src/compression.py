@@ -0,0 +1,70 @@
+"""
+gzip/brotli for responses of COMPRESS_MIN_SIZE bytes or more. Cached bodies are
+compressed once per version and the result is cached next to them (see cached_json()
+in app.py), every other response is compressed on the way out.
+"""
+import gzip
+import os
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 5))
+
+# in order of preference when the client accepts several with the same quality
+ENCODINGS = ("br", "gzip") if brotli is not None else ("gzip",)
+COMPRESSIBLE = ("application/json", "text/html", "text/plain")
+
+
+def negotiate(accept_encodings, size):
+    """The encoding to send `size` bytes with, None to send them as they are."""
+    if size < MIN_SIZE:
+        return None
+    best = None
+    for encoding in ENCODINGS:
+        quality = accept_encodings[encoding]
+        if quality and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    # mtime=0 so the same body always compresses to the same bytes
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def cached_variant(cache, key, body, etag, encoding):
+    # stored under key + (encoding,), so invalidating the key's prefix drops it too,
+    # and tagged with the etag of the body it was made from
+    variant = cache.get(key + (encoding,))
+    if variant is None or variant[1] != etag:
+        variant = (compress(body, encoding), etag)
+        cache.set(key + (encoding,), variant)
+    return variant[0]
+
+
+def compress_response(response):
+    # responses that did not come from the cache, compressed on every request
+    if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+        return response
+    if "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE:
+        return response
+    body = response.get_data()
+    encoding = negotiate(request.accept_encodings, len(body))
+    if len(body) >= MIN_SIZE:
+        response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
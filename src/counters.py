@@ -0,0 +1,77 @@
+"""
+Per entry favorite counts (the favorite_counts table) behind the /<case>/top leaderboards.
+The favorite routes update them in the same transaction as the favorites themselves.
+"""
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+from models import Favorites, Favorite_counts
+
+
+def upsert(session, increment):
+    # INSERT into favorite_counts that adds to (or with increment=False replaces) the
+    # count of entries that already have a row
+    dialect = session.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql.insert(Favorite_counts)
+        value = stmt.inserted.count
+        return stmt.on_duplicate_key_update(count=Favorite_counts.count + value if increment else value)
+    stmt = (postgresql if dialect == "postgresql" else sqlite).insert(Favorite_counts)
+    value = stmt.excluded.count
+    return stmt.on_conflict_do_update(index_elements=[Favorite_counts.kind, Favorite_counts.entity_id],
+                                      set_={"count": Favorite_counts.count + value if increment else value})
+
+
+def add(session, resource, entity_id, delta):
+    # relative updates, so concurrent requests on the same entry can not overwrite each other
+    session.execute(upsert(session, True), {"kind": resource.code, "entity_id": entity_id, "count": delta})
+
+
+def recount(session, resource, entity_ids):
+    # ranges of ix_favorites_kind_entity_id
+    favorited = (Favorites.kind == resource.code, Favorites.entity_id.in_(entity_ids))
+    counted = select(Favorites.kind, Favorites.entity_id, func.count()).where(*favorited).group_by(
+        Favorites.kind, Favorites.entity_id)
+    session.execute(upsert(session, False).from_select(["kind", "entity_id", "count"], counted))
+    # entries that just lost their last favorite have no group above
+    session.execute(update(Favorite_counts).where(
+        Favorite_counts.kind == resource.code, Favorite_counts.entity_id.in_(entity_ids),
+        Favorite_counts.entity_id.not_in(select(Favorites.entity_id).where(*favorited))).values(count=0))
+
+
+class Changes:
+    """Collects the count updates of several favorite INSERT/DELETE statements and writes
+    them with one statement on flush().
+
+    Where the database has RETURNING only the entries really changed are counted,
+    otherwise (MySQL) every entry the statement was limited to is counted again.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.pending = []
+        dialect = session.get_bind().dialect
+        self.returning = dialect.insert_returning and dialect.delete_returning
+
+    def apply(self, resource, stmt, entity_ids, delta):
+        # runs `stmt`, an INSERT (delta=1) or DELETE (delta=-1) of favorites of `resource`
+        # limited to `entity_ids`, and returns how many favorites it changed
+        if not self.returning:
+            rowcount = self.session.execute(stmt).rowcount
+            recount(self.session, resource, entity_ids)
+            return rowcount
+        changed = self.session.execute(stmt.returning(Favorites.entity_id)).scalars().all()
+        self.pending += [{"kind": resource.code, "entity_id": entity_id, "count": delta} for entity_id in changed]
+        return len(changed)
+
+    def flush(self):
+        if self.pending:
+            self.session.execute(upsert(self.session, True), self.pending)
+            self.pending = []
+
+
+def rebuild(session):
+    """Counts every favorite again, fixes any drift (favorites written around the API)."""
+    session.execute(delete(Favorite_counts))
+    session.execute(Favorite_counts.__table__.insert().from_select(
+        ["kind", "entity_id", "count"],
+        select(Favorites.kind, Favorites.entity_id, func.count()).group_by(Favorites.kind, Favorites.entity_id)))
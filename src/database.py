@@ -0,0 +1,71 @@
+import os
+
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+def engine_options(database_uri):
+    """SQLALCHEMY_ENGINE_OPTIONS built from the environment.
+
+    Every gunicorn worker owns its own pool, and a thread never holds more than one
+    connection, so the pool is sized from the threads per worker. When
+    DB_MAX_CONNECTIONS is set (the connection budget of the Postgres plan) it is
+    split between the workers so that workers * (pool_size + max_overflow) never
+    goes over it.
+    """
+    options = {
+        "pool_pre_ping": env_flag("DB_POOL_PRE_PING", "true")
+    }
+    if database_uri.startswith("sqlite"):
+        return options
+
+    workers = int(os.getenv("WEB_CONCURRENCY", 2))
+    threads = int(os.getenv("GUNICORN_THREADS", 4))
+    pool_size = int(os.getenv("DB_POOL_SIZE", threads))
+    max_overflow = int(os.getenv("DB_MAX_OVERFLOW", 2))
+    max_connections = os.getenv("DB_MAX_CONNECTIONS")
+    if max_connections:
+        per_worker = max(1, int(max_connections) // workers)
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+
+    options.update({
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800))
+    })
+
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+    if statement_timeout:
+        if database_uri.startswith("postgresql+asyncpg"):
+            options["connect_args"] = {"server_settings": {"statement_timeout": str(statement_timeout)}}
+        elif database_uri.startswith("postgresql"):
+            options["connect_args"] = {"options": "-c statement_timeout=%d" % statement_timeout}
+        elif database_uri.startswith("mysql"):
+            options["connect_args"] = {"init_command": "SET SESSION max_execution_time=%d" % statement_timeout}
+    return options
+
+
+def async_database_uri(database_uri, primary=True):
+    # same database through an asyncio driver, ASYNC_DATABASE_URL overrides the mapping
+    # of the primary's (a replica's is always mapped)
+    override = os.getenv("ASYNC_DATABASE_URL")
+    if override and primary:
+        return override
+    for scheme, async_scheme in (("sqlite://", "sqlite+aiosqlite://"), ("postgresql://", "postgresql+asyncpg://")):
+        if database_uri.startswith(scheme):
+            return async_scheme + database_uri[len(scheme):]
+    raise RuntimeError("No async driver known for " + database_uri.split("://")[0] + ", set ASYNC_DATABASE_URL")
+
+
+def pool_status(engine):
+    # QueuePool counters, other pool classes (SQLite's) only report what they have
+    pool = engine.pool
+    status = {}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            status[name] = method()
+    return status
@@ -0,0 +1,133 @@
+import logging
+import os
+import threading
+import time
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram:
+    """Prometheus style cumulative histogram with one series per label set."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, labels, value):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def expose(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            label_text = ",".join('%s="%s"' % pair for pair in labels)
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label_text, bound, bucket_count))
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label_text, count))
+            lines.append("%s_sum{%s} %s" % (self.name, label_text, total))
+            lines.append("%s_count{%s} %d" % (self.name, label_text, count))
+        return lines
+
+
+class Metrics:
+    """Per request latency, SQL and serialization instrumentation exported on /metrics.
+
+    SQL statements are counted through engine events, so every query issued while
+    handling a request is attributed to its endpoint. Requests slower than
+    SLOW_REQUEST_MS are logged together with the statements they ran.
+    """
+
+    def __init__(self, app=None):
+        self.slow_request_seconds = float(os.getenv("SLOW_REQUEST_MS", 500)) / 1000
+        self.latency = Histogram("http_request_duration_seconds", "Time spent handling the request", LATENCY_BUCKETS)
+        self.db_time = Histogram("http_request_db_seconds", "Time spent in SQL statements per request", LATENCY_BUCKETS)
+        self.sql_count = Histogram("http_request_sql_statements", "SQL statements executed per request", SQL_COUNT_BUCKETS)
+        self.serialization = Histogram("http_request_serialization_seconds", "Time spent encoding JSON per request", LATENCY_BUCKETS)
+        self.response_size = Histogram("http_response_size_bytes", "Response body size", SIZE_BUCKETS)
+        self._collectors = []
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+        # time every JSON encoding done through the app's provider (jsonify, cached bodies...)
+        dumps = app.json.dumps
+
+        def timed_dumps(obj, **kwargs):
+            start = time.perf_counter()
+            try:
+                return dumps(obj, **kwargs)
+            finally:
+                if has_request_context() and "metrics_start" in g:
+                    g.metrics_serialization += time.perf_counter() - start
+        app.json.dumps = timed_dumps
+
+        app.add_url_rule("/metrics", "metrics", self.export)
+
+    def register(self, name, type, help, collect):
+        # extra counters/gauges read at scrape time, collect() returns the current value
+        self._collectors.append((name, type, help, collect))
+
+    def _start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql = []
+        g.metrics_db_time = 0.0
+        g.metrics_serialization = 0.0
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "metrics_start" in g:
+            g.metrics_statement_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and "metrics_statement_start" in g:
+            elapsed = time.perf_counter() - g.pop("metrics_statement_start")
+            g.metrics_db_time += elapsed
+            g.metrics_sql.append((statement, elapsed))
+
+    def _finish_request(self, response):
+        if "metrics_start" not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        labels = (("endpoint", request.endpoint or "unmatched"), ("method", request.method))
+        with self._lock:
+            self.latency.observe(labels, elapsed)
+            self.db_time.observe(labels, g.metrics_db_time)
+            self.sql_count.observe(labels, len(g.metrics_sql))
+            self.serialization.observe(labels, g.metrics_serialization)
+            if response.content_length is not None:
+                self.response_size.observe(labels, response.content_length)
+        if elapsed >= self.slow_request_seconds:
+            logger.warning("Slow request %s %s took %.1f ms (%d SQL statements, %.1f ms in the database)\n%s",
+                           request.method, request.full_path, elapsed * 1000, len(g.metrics_sql),
+                           g.metrics_db_time * 1000,
+                           "\n".join("  %.1f ms  %s" % (took * 1000, statement) for statement, took in g.metrics_sql))
+        return response
+
+    def export(self):
+        lines = []
+        with self._lock:
+            for histogram in (self.latency, self.db_time, self.sql_count, self.serialization, self.response_size):
+                lines += histogram.expose()
+        for name, type, help, collect in self._collectors:
+            lines += ["# HELP %s %s" % (name, help), "# TYPE %s %s" % (name, type), "%s %s" % (name, collect())]
+        return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4"}
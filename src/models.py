@@ -1,11 +1,12 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean
+from sqlalchemy import String, Boolean, SmallInteger, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.orm import relationship
 from typing import List
 from sqlalchemy import ForeignKey
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 class User(db.Model):
@@ -15,16 +16,7 @@ class User(db.Model):
     password: Mapped[str] = mapped_column(nullable=False)
     username: Mapped[str] = mapped_column(nullable=False)
 
-    favorites_characters_user: Mapped[List["Favorites_characters"]] = relationship(
-        back_populates="user")
-    favorites_planets_user: Mapped[List["Favorites_planets"]] = relationship(
-        back_populates="user")
-    favorites_films_user: Mapped[List["Favorites_films"]] = relationship(
-        back_populates="user")
-    favorites_vehicles_user: Mapped[List["Favorites_vehicles"]] = relationship(
-        back_populates="user")
-    favorites_species_user: Mapped[List["Favorites_species"]] = relationship(
-        back_populates="user")
+    favorites: Mapped[List["Favorites"]] = relationship(back_populates="user")
 
     def serialize(self):
         return {
@@ -41,9 +33,6 @@ class Characters(db.Model):
     description: Mapped[str] = mapped_column(nullable=False)
     imageLink: Mapped[str] = mapped_column(nullable=False)
 
-    favorites_characters: Mapped[List["Favorites_characters"]] = relationship(
-        back_populates="characters")
-
     def serialize(self):
         return {
             "id": self.id,
@@ -60,9 +49,6 @@ class Planets(db.Model):
     description: Mapped[str] = mapped_column(nullable=False)
     imageLink: Mapped[str] = mapped_column(nullable=False)
 
-    favorites_planets: Mapped[List["Favorites_planets"]
-                              ] = relationship(back_populates="planets")
-
     def serialize(self):
         return {
             "id": self.id,
@@ -80,9 +66,6 @@ class Films(db.Model):
     description: Mapped[str] = mapped_column(nullable=False)
     imageLink: Mapped[str] = mapped_column(nullable=False)
 
-    favorites_films: Mapped[List["Favorites_films"]
-                            ] = relationship(back_populates="films")
-
     def serialize(self):
         return {
             "id": self.id,
@@ -99,9 +82,6 @@ class Vehicles(db.Model):
     description: Mapped[str] = mapped_column(nullable=False)
     imageLink: Mapped[str] = mapped_column(nullable=False)
 
-    favorites_vehicles: Mapped[List["Favorites_vehicles"]] = relationship(
-        back_populates="vehicles")
-
     def serialize(self):
         return {
             "id": self.id,
@@ -118,9 +98,6 @@ class Species(db.Model):
     description: Mapped[str] = mapped_column(nullable=False)
     imageLink: Mapped[str] = mapped_column(nullable=False)
 
-    favorites_species: Mapped[List["Favorites_species"]
-                              ] = relationship(back_populates="species")
-
     def serialize(self):
         return {
             "id": self.id,
@@ -131,96 +108,47 @@ class Species(db.Model):
         }
 
 
-class Favorites_characters(db.Model):
-    id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
-    character_id: Mapped[int] = mapped_column(ForeignKey("characters.id"))
-
-    user: Mapped["User"] = relationship(
-        back_populates="favorites_characters_user")
-    characters: Mapped["Characters"] = relationship(
-        back_populates="favorites_characters")
-
-    def serialize(self):
-        return {
-            "id": self.id,
-            "user_id": self.user_id,
-            "character_id": self.character_id,
-            # do not serialize the password, its a security breach
-        }
-
+class Favorites(db.Model):
+    # one row per favorite of every kind, kind is the kind code of the resource (see
+    # resources.py); a user's favorites are one range of the primary key, which on SQLite
+    # is the table itself (WITHOUT ROWID). entity_id has no foreign key (it points to a
+    # different table for every kind): deleting a catalog entry (the admin's CatalogView)
+    # deletes its favorites and favorite_counts rows in the app, deleting a user (UserView)
+    # deletes theirs and counts the entries again
+    __table_args__ = {"sqlite_with_rowid": False}
 
-class Favorites_planets(db.Model):
-    id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
-    planets_id: Mapped[int] = mapped_column(ForeignKey("planets.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), primary_key=True)
+    kind: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    entity_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
 
-    user: Mapped["User"] = relationship(
-        back_populates="favorites_planets_user")
-    planets: Mapped["Planets"] = relationship(
-        back_populates="favorites_planets")
+    user: Mapped["User"] = relationship(back_populates="favorites")
 
     def serialize(self):
         return {
-            "id": self.id,
             "user_id": self.user_id,
-            "planets_id": self.planets_id,
-            # do not serialize the password, its a security breach
+            "kind": self.kind,
+            "entity_id": self.entity_id
         }
 
 
-class Favorites_films(db.Model):
-    id: Mapped[int] = mapped_column(primary_key=True)
+# who favorited an entry, for the favorite_counts recounts
+Index("ix_favorites_kind_entity_id", Favorites.kind, Favorites.entity_id)
 
-    # Emparentar a User.
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
-    films_id: Mapped[int] = mapped_column(ForeignKey("films.id"))
 
-    user: Mapped["User"] = relationship(back_populates="favorites_films_user")
-    films: Mapped["Films"] = relationship(back_populates="favorites_films")
+class Favorite_counts(db.Model):
+    # how many users favorited each catalog entry, kept up to date by the favorite
+    # routes; kind is the kind code of the resource (see resources.py)
+    kind: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    entity_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    count: Mapped[int] = mapped_column(nullable=False, default=0)
 
     def serialize(self):
         return {
-            "id": self.id,
-            "name": self.name,
-            "description": self.description,
-            # do not serialize the password, its a security breach
+            "kind": self.kind,
+            "entity_id": self.entity_id,
+            "count": self.count
         }
 
 
-class Favorites_vehicles(db.Model):
-    id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
-    vehicles_id: Mapped[int] = mapped_column(ForeignKey("vehicles.id"))
-
-    user: Mapped["User"] = relationship(
-        back_populates="favorites_vehicles_user")
-    vehicles: Mapped["Vehicles"] = relationship(
-        back_populates="favorites_vehicles")
-
-    def serialize(self):
-        return {
-            "id": self.id,
-            "user_id": self.user_id,
-            "vehicles_id": self.vehicles_id,
-            # do not serialize the password, its a security breach
-        }
-
-
-class Favorites_species(db.Model):
-    id: Mapped[int] = mapped_column(primary_key=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
-    species_id: Mapped[int] = mapped_column(ForeignKey("species.id"))
-
-    user: Mapped["User"] = relationship(
-        back_populates="favorites_species_user")
-    species: Mapped["Species"] = relationship(
-        back_populates="favorites_species")
-
-    def serialize(self):
-        return {
-            "id": self.id,
-            "user_id": self.user_id,
-            "species_id": self.species_id,
-            # do not serialize the password, its a security breach
-        }
+# the leaderboard of a kind is read straight from this index
+Index("ix_favorite_counts_kind_count", Favorite_counts.kind, Favorite_counts.count.desc(), Favorite_counts.entity_id)
@@ -0,0 +1,130 @@
+"""
+Statements and payloads of the read endpoints. They only build SQL and shape rows, so
+the WSGI app (app.py) and the async app (asgi.py) serve identical responses.
+"""
+from sqlalchemy import select, union_all, tuple_, bindparam
+from utils import APIException, get_page_args, encode_cursor, decode_cursor
+from resources import CATALOG, KINDS
+from models import Favorites
+
+_favorites_statements = {}
+
+
+def list_statement(resource, args):
+    # ?fields=id,name selects only those columns, ?<field>=value filters on equality and
+    # ?<field>=prefix* on a prefix, ?sort=<field> or -<field> (an indexed field) orders
+    # the keyset pages. Everything is pushed down into the SELECT, rows are never loaded as ORM objects.
+    model = resource.model
+    public = resource.fields
+    limit, after = get_page_args(args)
+
+    names = [name.strip() for name in args.get("fields", ",".join(public)).split(",") if name.strip()]
+    if not names:
+        raise APIException("fields must name at least one field", status_code=400)
+    sort = args.get("sort", "id")
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    unknown = [name for name in names + [sort] if name not in public]
+    if unknown:
+        raise APIException("Unknown fields: " + ", ".join(unknown), status_code=400)
+    if sort not in resource.sortable:
+        raise APIException("sort must be one of: " + ", ".join(resource.sortable), status_code=400)
+
+    key = getattr(model, sort)
+    stmt = select(*[getattr(model, name) for name in names], key.label("sort_key"), model.id.label("row_id"))
+    for name in public:
+        value = args.get(name)
+        if value is None:
+            continue
+        column = getattr(model, name)
+        if name == "id":
+            if not value.isdigit():
+                raise APIException("id must be an integer", status_code=400)
+            stmt = stmt.where(column == int(value))
+        elif value.endswith("*"):
+            stmt = stmt.where(column.startswith(value[:-1], autoescape=True))
+        else:
+            stmt = stmt.where(column == value)
+
+    if after is not None:
+        if sort == "id":
+            if not after.isdigit():
+                raise APIException("after must be an integer", status_code=400)
+            boundary = model.id < int(after) if descending else model.id > int(after)
+        else:
+            cursor = decode_cursor(after)
+            if not isinstance(cursor, list) or len(cursor) != 2:
+                raise APIException("Invalid cursor", status_code=400)
+            value, row_id = cursor
+            # the database would fail on anything but a value of the sort column's type
+            # (lists, objects, a number for a text column...) with a 500
+            typed = isinstance(value, key.type.python_type) and not isinstance(value, bool)
+            if not typed or type(row_id) is not int:
+                raise APIException("Invalid cursor", status_code=400)
+            row = tuple_(key, model.id)
+            boundary = row < tuple_(value, row_id) if descending else row > tuple_(value, row_id)
+        stmt = stmt.where(boundary)
+    order = [key.desc(), model.id.desc()] if descending else [key, model.id]
+    if sort == "id":
+        order = order[:1]
+    return names, stmt.order_by(*order).limit(limit + 1)
+
+
+def list_payload(resource, args, names, rows):
+    limit, after = get_page_args(args)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = last.row_id if args.get("sort", "id").lstrip("-") == "id" else encode_cursor(
+            [last.sort_key, last.row_id])
+    return {
+        resource.name: [dict(zip(names, row)) for row in rows[:limit]],
+        "next": next_cursor
+    }
+
+
+def detail_payload(resource, row):
+    return {resource.key: dict(zip(resource.fields, row))}
+
+
+def favorites_statement(expand=False):
+    # A user's favorites are one range of the favorites primary key. Expanding joins each
+    # kind's range to its own table, one UNION ALL instead of one HTTP request per
+    # favorite. Built once per shape, the user is bound with {"user_id": ...} at execution.
+    if expand in _favorites_statements:
+        return _favorites_statements[expand]
+    columns = [Favorites.kind, Favorites.user_id, Favorites.entity_id]
+    if not expand:
+        stmt = select(*columns).where(Favorites.user_id == bindparam("user_id"))
+    else:
+        stmt = union_all(*[
+            select(*columns, resource.display.label("display"), resource.model.description, resource.model.imageLink)
+            .join(resource.model, Favorites.entity_id == resource.model.id)
+            .where(Favorites.user_id == bindparam("user_id"), Favorites.kind == resource.code)
+            for resource in CATALOG.values()
+        ])
+    _favorites_statements[expand] = stmt.order_by("kind", "entity_id")
+    return _favorites_statements[expand]
+
+
+def favorites_payload(username, rows, expand):
+    response_body = {"username": username}
+    for name in CATALOG:
+        response_body["favorite " + name] = []
+
+    for row in rows:
+        resource = KINDS[row.kind]
+        item = {
+            "user_id": row.user_id,
+            resource.favorite_key: row.entity_id
+        }
+        if expand:
+            item["entity"] = {
+                "id": row.entity_id,
+                resource.display.key: row.display,
+                "description": row.description,
+                "imageLink": row.imageLink
+            }
+        response_body["favorite " + resource.name].append(item)
+
+    return response_body
@@ -0,0 +1,205 @@
+"""
+Read replicas. With DATABASE_REPLICA_URLS set, the views marked @read_only run their
+queries on a replica and everything else stays on the primary (DATABASE_URL):
+
+    DATABASE_REPLICA_URLS=postgresql://replica-1/db,postgresql://replica-2/db
+    REPLICA_POLICY=round_robin or least_connections (checked out connections)
+    REPLICA_HEALTH_INTERVAL=5   seconds between two health checks of a replica
+    REPLICA_MAX_LAG=2           seconds reads stay on the primary after a write
+
+Replication is asynchronous, so every commit on the primary raises a fence: for the
+next REPLICA_MAX_LAG seconds reads go to the primary. Clients get their own writes back
+and rows a replica has not replayed yet never end up in the response cache. The fence
+is kept next to the response cache (its own table or namespace of CACHE_URL, out of its
+slots and hit counters), so it covers every worker sharing CACHE_URL.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+from flask import current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from cache import cache_from_url, LRUCache
+from database import engine_options
+
+logger = logging.getLogger(__name__)
+
+FENCE_KEY = ("replica-fence",)
+POLICIES = ("round_robin", "least_connections")
+
+
+def read_only(view):
+    """Marks a view whose queries may run on a replica."""
+    view.read_only = True
+    return view
+
+
+class RoutingSession(Session):
+    """db.session class. While info["replicas"] is set (by Replicas for read-only views)
+    the first statement picks a replica that the rest of the request then uses, unless
+    the primary is fenced or no replica is healthy. Writes, ORM flushes as well as Core
+    insert/update/delete run with session.execute(), always go to the primary, and an
+    insert/update/delete keeps the rest of the request there."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replicas = self.info.get("replicas")
+        if replicas is not None and clause is not None and clause.is_dml:
+            # (ORM bulk statements ask again without the clause)
+            self.info["replica"] = None
+        if replicas is not None and bind is None and not self._flushing:
+            if "replica" not in self.info:
+                self.info["replica"] = replicas.choose()
+            if self.info["replica"] is not None:
+                return self.info["replica"].engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class Replica:
+    def __init__(self, engine):
+        self.engine = engine
+        self.healthy = True
+        self.in_use = 0
+        self.reads = 0
+
+    def stats(self):
+        return {
+            "url": self.engine.url.render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "in_use": self.in_use,
+            "reads": self.reads
+        }
+
+
+class Replicas:
+    """Replica engines of the app, their health and the choice of one per request."""
+
+    def __init__(self, app=None):
+        self.replicas = []
+        self.policy = os.getenv("REPLICA_POLICY", "round_robin")
+        if self.policy not in POLICIES:
+            raise ValueError("REPLICA_POLICY must be one of " + ", ".join(POLICIES))
+        self.health_interval = float(os.getenv("REPLICA_HEALTH_INTERVAL", 5))
+        self.max_lag = float(os.getenv("REPLICA_MAX_LAG", 2))
+        self.fenced_until = 0.0
+        self.fence_cache = cache_from_url(os.getenv("CACHE_URL", "memory://"), maxsize=1, ttl=self.max_lag,
+                                          name="replica_fence")
+        self.primary_reads = 0
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._checker_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        urls = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+        for url in urls:
+            url = url.replace("postgres://", "postgresql://")
+            replica = Replica(create_engine(url, **engine_options(url)))
+            self.watch(replica, replica.engine)
+            self.replicas.append(replica)
+        app.extensions["replicas"] = self
+        if self.replicas:
+            # any engine but the replicas is the primary (the API's, the admin's...)
+            event.listen(Engine, "commit", self._fence)
+            app.before_request(self._route)
+
+    def watch(self, replica, engine):
+        """Counts the connections `engine` (the replica's, or another engine on the same
+        database) checks out for least_connections, and marks the replica unhealthy when
+        it gets disconnected."""
+        event.listen(engine, "checkout", lambda *args: self._count(replica, 1))
+        event.listen(engine, "checkin", lambda *args: self._count(replica, -1))
+        event.listen(engine, "handle_error", lambda context: self._failed(replica, context))
+
+    def _count(self, replica, delta):
+        with self._lock:
+            replica.in_use += delta
+
+    def _failed(self, replica, context):
+        if context.is_disconnect and replica.healthy:
+            replica.healthy = False
+            logger.warning("Replica %s marked unhealthy: %s", replica.stats()["url"], context.original_exception)
+
+    def _fence(self, connection):
+        if any(connection.engine is replica.engine for replica in self.replicas):
+            return
+        self.fenced_until = time.time() + self.max_lag
+        self.fence_cache.set(FENCE_KEY, (b"", repr(self.fenced_until)))
+
+    def fenced(self):
+        if time.time() < self.fenced_until:
+            return True
+        # another worker's write, an in-process cache only ever holds this worker's fence
+        if isinstance(self.fence_cache, LRUCache):
+            return False
+        entry = self.fence_cache.get(FENCE_KEY)
+        return entry is not None and time.time() < float(entry[1])
+
+    def _route(self):
+        # the session outlives the request when the app context does (tests, CLI...), so
+        # the previous request's choice is always reset
+        info = current_app.extensions["sqlalchemy"].session.info
+        info.pop("replica", None)
+        info.pop("replicas", None)
+        if request.method not in ("GET", "HEAD"):
+            return
+        view = current_app.view_functions.get(request.endpoint)
+        if getattr(view, "read_only", False):
+            info["replicas"] = self
+
+    def choose(self):
+        """The replica to read from, None to read from the primary."""
+        self._start_checker()
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy or self.fenced():
+            self.primary_reads += 1
+            return None
+        if self.policy == "least_connections":
+            # ties (idle replicas) go to the one that served the fewest reads
+            replica = min(healthy, key=lambda replica: (replica.in_use, replica.reads))
+        else:
+            replica = healthy[next(self._turn) % len(healthy)]
+        replica.reads += 1
+        return replica
+
+    def _start_checker(self):
+        # one thread per process, started again after gunicorn forks the worker
+        if self._checker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._checker_pid != os.getpid():
+                self._checker_pid = os.getpid()
+                threading.Thread(target=self._check_forever, name="replica-health", daemon=True).start()
+
+    def _check_forever(self):
+        while True:
+            self.check()
+            time.sleep(self.health_interval)
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+                healthy = True
+            except Exception as error:
+                healthy = False
+                if replica.healthy:
+                    logger.warning("Replica %s failed its health check: %s", replica.stats()["url"], error)
+            if healthy and not replica.healthy:
+                logger.info("Replica %s is healthy again", replica.stats()["url"])
+            replica.healthy = healthy
+
+    def healthy_count(self):
+        return sum(replica.healthy for replica in self.replicas)
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "fenced": self.fenced(),
+            "primary_reads": self.primary_reads,
+            "replicas": [replica.stats() for replica in self.replicas]
+        }
@@ -0,0 +1,79 @@
+"""
+Registry of the resources served by the API. Routes, favorites, search, the admin and
+the cache keys are all generated from it, so a new resource type is one register() call.
+"""
+from sqlalchemy import select, delete, bindparam
+from models import Favorites, Favorite_counts, User, Characters, Planets, Films, Vehicles, Species
+
+# resource name -> Resource
+RESOURCES = {}
+# the favoritable, searchable, cached resources, by name and by kind code
+CATALOG = {}
+KINDS = {}
+
+
+class Resource:
+    """A table served under /<name>.
+
+    `fields` are the columns clients can read, filter on and pick with ?fields=, the
+    indexed ones (the primary key, unique or index=True columns) can also be sorted by.
+    Catalog resources also have a kind `code` (stable, it is stored in the favorites
+    tables and the search index), the `favorite_key` their favorites show the entity id
+    under, and a `display` column that names an entry in responses.
+    """
+
+    def __init__(self, name, model, fields, key=None, code=None, favorite_key=None, display=None):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.key = key or name
+        self.code = code
+        self.favorite_key = favorite_key
+        self.display = display
+        self.columns = [getattr(model, field) for field in fields]
+        # sorting on any other column would make every keyset page sort the whole table
+        self.sortable = [field for field in fields
+                         if any(getattr(model.__table__.c[field], flag) for flag in ("primary_key", "unique", "index"))]
+
+        # built once here, SQLAlchemy then reuses their compiled form
+        self.detail = select(*self.columns).where(model.id == bindparam("entity_id"))
+        self.stream = select(*self.columns).order_by(model.id)
+        if code is not None:
+            self.display_by_id = select(display).where(model.id == bindparam("entity_id"))
+            self.remove_favorite = delete(Favorites).where(
+                Favorites.user_id == bindparam("user_id"), Favorites.kind == code,
+                Favorites.entity_id == bindparam("entity_id"))
+            # most favorited first, a range scan of ix_favorite_counts_kind_count
+            self.top = (select(model.id, display.label("display"), model.imageLink, Favorite_counts.count)
+                        .select_from(Favorite_counts)
+                        .join(model, model.id == Favorite_counts.entity_id)
+                        .where(Favorite_counts.kind == code, Favorite_counts.count > 0)
+                        .order_by(Favorite_counts.count.desc(), Favorite_counts.entity_id)
+                        .limit(bindparam("limit")))
+
+    @property
+    def catalog(self):
+        return self.code is not None
+
+
+def register(resource):
+    RESOURCES[resource.name] = resource
+    if resource.catalog:
+        CATALOG[resource.name] = resource
+        KINDS[resource.code] = resource
+    return resource
+
+
+CATALOG_FIELDS = ("id", "name", "description", "imageLink")
+
+register(Resource("planets", Planets, CATALOG_FIELDS, key="planet", code=1,
+                  favorite_key="planets_id", display=Planets.name))
+register(Resource("characters", Characters, CATALOG_FIELDS, key="character", code=2,
+                  favorite_key="character_id", display=Characters.name))
+register(Resource("films", Films, ("id", "title", "description", "imageLink"), key="film", code=3,
+                  favorite_key="films_id", display=Films.title))
+register(Resource("vehicles", Vehicles, CATALOG_FIELDS, key="vehicle", code=4,
+                  favorite_key="vehicles_id", display=Vehicles.name))
+register(Resource("species", Species, CATALOG_FIELDS, key="species", code=5,
+                  favorite_key="species_id", display=Species.name))
+register(Resource("users", User, ("id", "email", "username")))
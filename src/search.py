@@ -0,0 +1,57 @@
+from sqlalchemy import select, union_all, func, literal, literal_column, or_, text, inspect
+from resources import CATALOG
+
+ENGLISH = literal_column("'english'")
+
+# SQLite stand-in for the Postgres GIN indexes, kept up to date by triggers (see migration 7c3e91b2d4f8),
+# its rowids are id * 8 + the kind code of the resource
+SQLITE_SEARCH = text(
+    'SELECT kind, entity_id AS id, name, imageLink AS "imageLink", -bm25(catalog_search) AS rank '
+    "FROM catalog_search WHERE catalog_search MATCH :q "
+    "ORDER BY rank DESC, kind, entity_id LIMIT :limit OFFSET :offset"
+)
+
+_sqlite_index = {}
+
+
+def document(model, title):
+    # must stay identical to the expression of the ix_<table>_search GIN indexes
+    return func.to_tsvector(ENGLISH, title.concat(literal_column("' '")).concat(model.description))
+
+
+def fts_terms(q):
+    # quote every term so user input can not use the FTS5 query syntax
+    return " ".join('"%s"' % term.replace('"', '""') for term in q.split())
+
+
+def has_sqlite_index(bind):
+    if bind.url not in _sqlite_index:
+        _sqlite_index[bind.url] = inspect(bind).has_table("catalog_search")
+    return _sqlite_index[bind.url]
+
+
+def search(session, q, limit, offset):
+    """Ranked matches for `q` in the name/title and description of every catalog table."""
+    bind = session.get_bind()
+    if bind.dialect.name == "sqlite" and has_sqlite_index(bind):
+        return session.execute(SQLITE_SEARCH, {"q": fts_terms(q), "limit": limit, "offset": offset}).all()
+
+    selects = []
+    if bind.dialect.name == "postgresql":
+        query = func.plainto_tsquery(ENGLISH, q)
+        for kind, resource in CATALOG.items():
+            model, title = resource.model, resource.display
+            vector = document(model, title)
+            selects.append(select(literal(kind).label("kind"), model.id.label("id"), title.label("name"),
+                                  model.imageLink.label("imageLink"), func.ts_rank(vector, query).label("rank"))
+                           .where(vector.op("@@")(query)))
+    else:
+        # no full-text index for this database, plain substring match
+        pattern = "%" + q + "%"
+        for kind, resource in CATALOG.items():
+            model, title = resource.model, resource.display
+            selects.append(select(literal(kind).label("kind"), model.id.label("id"), title.label("name"),
+                                  model.imageLink.label("imageLink"), literal(0.0).label("rank"))
+                           .where(or_(title.ilike(pattern), model.description.ilike(pattern))))
+    stmt = union_all(*selects).order_by(literal_column("rank").desc(), "kind", "id").limit(limit).offset(offset)
+    return session.execute(stmt).all()
@@ -1,3 +1,5 @@
+import base64
+import json
 from flask import jsonify, url_for
 
 class APIException(Exception):
@@ -15,6 +17,26 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def get_page_args(args, default_limit=100, max_limit=1000):
+    # keyset pagination: ?limit=<n>&after=<the "next" value of the previous page>,
+    # after is the last id, or an opaque cursor when the list is sorted by another field
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise APIException('limit must be an integer', status_code=400)
+    if limit < 1:
+        raise APIException('limit must be greater than 0', status_code=400)
+    return min(limit, max_limit), args.get('after') or None
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise APIException('Invalid cursor', status_code=400)
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
@@ -1,7 +1,11 @@
 # This file was created to run the application on heroku using gunicorn.
 # Read more about it here: https://devcenter.heroku.com/articles/python-gunicorn
 
-from app import app as application
+from app import create_app
+from database import env_flag
+
+# SERVE_ONLY=1 serves the API alone, without the admin
+application = create_app(serve_only=env_flag("SERVE_ONLY", "false"))
 
 if __name__ == "__main__":
     application.run()
@@ -0,0 +1,28 @@
+"""
+The API app on a SQLite file of its own for every test, with an empty response cache.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv("DATABASE_URL", "sqlite:///" + str(tmp_path / "api.db"))
+    from app import create_app
+    from cache import catalog_cache
+    from models import db
+    app = create_app(serve_only=True)
+    with app.app_context():
+        db.create_all()
+    catalog_cache.clear()
+    yield app
+    catalog_cache.clear()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
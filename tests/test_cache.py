@@ -0,0 +1,131 @@
+"""
+The response cache backends of src/cache.py behave the same: entries, expiry and
+dropping every key under a prefix but nothing else. Redis runs against fakeredis.
+
+    pipenv run test
+"""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from cache import LRUCache, SQLiteCache, RedisCache  # noqa: E402
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        return LRUCache(maxsize=100, ttl=60)
+    if request.param == "sqlite":
+        return SQLiteCache(str(tmp_path / "cache.db"), maxsize=100, ttl=60)
+    return RedisCache(fakeredis.FakeRedis())
+
+
+def test_get_set(cache):
+    assert cache.get(("planets", "list")) is None
+    cache.set(("planets", "list"), (b'{"planets":[]}', '"etag-1"'))
+    assert cache.get(("planets", "list")) == (b'{"planets":[]}', '"etag-1"')
+    cache.set(("planets", "list"), (b"{}", '"etag-2"'))
+    assert cache.get(("planets", "list")) == (b"{}", '"etag-2"')
+
+
+def test_body_with_newlines(cache):
+    cache.set(("planets", 1), (b'{"a":1}\n{"b":2}\n', "etag"))
+    assert cache.get(("planets", 1)) == (b'{"a":1}\n{"b":2}\n', "etag")
+
+
+def test_invalidate_prefix(cache):
+    cache.set(("planets", "list", ("limit", "5")), (b"1", "e1"))
+    cache.set(("planets", 3), (b"2", "e2"))
+    cache.set(("films", 3), (b"3", "e3"))
+    cache.invalidate("planets")
+    assert cache.get(("planets", "list", ("limit", "5"))) is None
+    assert cache.get(("planets", 3)) is None
+    assert cache.get(("films", 3)) == (b"3", "e3")
+
+
+def test_invalidate_leaves_sibling_keys(cache):
+    # ("favorites", 5) must not take ("favorites", 50) or ("favorites", "5") with it
+    cache.set(("favorites", 5), (b"5", "e5"))
+    cache.set(("favorites", 5, "expand"), (b"5x", "e5x"))
+    cache.set(("favorites", 50), (b"50", "e50"))
+    cache.set(("favorites", "5"), (b"s5", "es5"))
+    cache.invalidate("favorites", 5)
+    assert cache.get(("favorites", 5)) is None
+    assert cache.get(("favorites", 5, "expand")) is None
+    assert cache.get(("favorites", 50)) == (b"50", "e50")
+    assert cache.get(("favorites", "5")) == (b"s5", "es5")
+    cache.invalidate("favorites")
+    assert cache.get(("favorites", 50)) is None
+    assert cache.get(("favorites", "5")) is None
+
+
+def test_invalidate_missing_prefix(cache):
+    cache.invalidate("nothing", "here")
+    cache.set(("planets", 1), (b"1", "e1"))
+    assert cache.get(("planets", 1)) == (b"1", "e1")
+
+
+def test_clear(cache):
+    cache.set(("planets", 1), (b"1", "e1"))
+    cache.set(("favorites", 1), (b"2", "e2"))
+    cache.clear()
+    assert cache.get(("planets", 1)) is None
+    assert cache.get(("favorites", 1)) is None
+
+
+def test_hit_and_miss_counters(cache):
+    cache.get(("planets", 1))
+    cache.set(("planets", 1), (b"1", "e1"))
+    cache.get(("planets", 1))
+    cache.get(("planets", 1))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_ttl(cache):
+    cache.ttl = 0.05
+    cache.set(("planets", 1), (b"1", "e1"))
+    time.sleep(0.1)
+    assert cache.get(("planets", 1)) is None
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set(("a",), (b"a", "a"))
+    cache.set(("b",), (b"b", "b"))
+    cache.get(("a",))
+    cache.set(("c",), (b"c", "c"))
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == (b"a", "a")
+
+
+def test_redis_invalidate_races_a_set(monkeypatch):
+    # a set() under the prefix between the SMEMBERS and the DEL of invalidate() must be
+    # dropped as well, not left cached until its TTL
+    server = fakeredis.FakeServer()
+    cache = RedisCache(fakeredis.FakeRedis(server=server))
+    other_worker = RedisCache(fakeredis.FakeRedis(server=server))
+    cache.set(("favorites", 1), (b"old", "e1"))
+
+    pipeline = type(cache.client.pipeline())
+    smembers = pipeline.smembers
+    calls = []
+
+    def smembers_then_set(self, name):
+        members = smembers(self, name)
+        if not calls:
+            other_worker.set(("favorites", 1, "expand"), (b"new", "e2"))
+        calls.append(name)
+        return members
+
+    monkeypatch.setattr(pipeline, "smembers", smembers_then_set)
+    cache.invalidate("favorites", 1)
+    assert len(calls) == 2
+    assert cache.get(("favorites", 1)) is None
+    assert cache.get(("favorites", 1, "expand")) is None
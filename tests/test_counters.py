@@ -0,0 +1,119 @@
+"""
+favorite_counts as the favorite routes keep it: after any mix of adds, removes and batch
+operations it holds what counters.rebuild() counts from the favorites, and /<case>/top
+serves it. Runs once as SQLite is (RETURNING) and once as a database without RETURNING
+(MySQL), where counters.Changes counts the entries again.
+"""
+import pytest
+from sqlalchemy import select
+
+import counters
+from models import db, Favorites, Favorite_counts, Films, Planets, User
+
+
+@pytest.fixture(params=["returning", "recount"])
+def client(request, app, monkeypatch):
+    if request.param == "recount":
+        monkeypatch.setattr(counters.Changes, "__init__", recount_changes)
+    with app.app_context():
+        db.session.add_all(User(email="user%d@example.com" % i, password="x", username="user%d" % i)
+                           for i in range(1, 4))
+        db.session.add_all(Planets(name="planet %d" % i, description="d", imageLink="i") for i in range(1, 5))
+        db.session.add_all(Films(title="film %d" % i, description="d", imageLink="i") for i in range(1, 5))
+        db.session.commit()
+    return app.test_client()
+
+
+def recount_changes(self, session):
+    self.session = session
+    self.pending = []
+    self.returning = False
+
+
+def counts(app):
+    # favorite_counts without its zero rows, next to what a rebuild makes of it
+    with app.app_context():
+        query = select(Favorite_counts.kind, Favorite_counts.entity_id, Favorite_counts.count).where(
+            Favorite_counts.count > 0).order_by(Favorite_counts.kind, Favorite_counts.entity_id)
+        kept = db.session.execute(query).all()
+        counters.rebuild(db.session)
+        rebuilt = db.session.execute(query).all()
+        db.session.rollback()
+    return kept, rebuilt
+
+
+def test_add_and_remove(app, client):
+    assert client.post("/favorite/1/planets/1").status_code == 200
+    assert client.post("/favorite/2/planets/1").status_code == 200
+    assert client.post("/favorite/2/planets/2").status_code == 200
+    assert client.post("/favorite/1/planets/1").status_code == 409
+    assert client.post("/favorite/1/planets/99").status_code == 404
+    assert client.delete("/favorite/2/planets/1").status_code == 200
+    assert client.delete("/favorite/2/planets/1").status_code == 404
+    kept, rebuilt = counts(app)
+    assert kept == rebuilt == [(1, 1, 1), (1, 2, 1)]
+
+
+def test_batch(app, client):
+    client.post("/favorite/2/films/3")
+    response = client.post("/users/1/favorites", json=[
+        {"op": "add", "kind": "planets", "id": 1},
+        {"op": "add", "kind": "planets", "id": 2},
+        # duplicates, the last operation on a favorite wins
+        {"op": "add", "kind": "planets", "id": 2},
+        {"op": "add", "kind": "planets", "id": 3},
+        {"op": "remove", "kind": "planets", "id": 3},
+        # unknown ids are skipped, unknown kinds reported
+        {"op": "add", "kind": "planets", "id": 99},
+        {"op": "add", "kind": "starships", "id": 1},
+        {"op": "add", "kind": "films", "id": 3},
+        {"op": "remove", "kind": "films", "id": 4},
+    ])
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body["added"], body["removed"]) == ({"planets": 2, "films": 1}, {"planets": 0, "films": 0})
+    assert [error["index"] for error in body["errors"]] == [6]
+
+    response = client.post("/users/1/favorites", json=[
+        {"op": "add", "kind": "planets", "id": 1},
+        {"op": "remove", "kind": "planets", "id": 2},
+        {"op": "remove", "kind": "films", "id": 3},
+    ])
+    assert (response.get_json()["added"], response.get_json()["removed"]) == ({"planets": 0}, {"planets": 1, "films": 1})
+    kept, rebuilt = counts(app)
+    assert kept == rebuilt == [(1, 1, 1), (3, 3, 1)]
+
+
+def test_remove_last_favorite(app, client):
+    client.post("/users/1/favorites", json=[{"op": "add", "kind": "planets", "id": 4}])
+    client.post("/users/1/favorites", json=[{"op": "remove", "kind": "planets", "id": 4}])
+    kept, rebuilt = counts(app)
+    assert kept == rebuilt == []
+
+
+def test_top(app, client):
+    assert client.get("/planets/top").get_json() == {"planets": []}
+    for user_id in (1, 2, 3):
+        client.post("/favorite/%d/planets/2" % user_id)
+    client.post("/users/1/favorites", json=[{"op": "add", "kind": "planets", "id": 4}])
+    client.post("/users/2/favorites", json=[{"op": "add", "kind": "planets", "id": 4},
+                                            {"op": "remove", "kind": "planets", "id": 2}])
+    top = client.get("/planets/top").get_json()["planets"]
+    assert [(planet["id"], planet["favorites"]) for planet in top] == [(2, 2), (4, 2)]
+    client.delete("/favorite/1/planets/2")
+    top = client.get("/planets/top?limit=1").get_json()["planets"]
+    assert [(planet["id"], planet["favorites"]) for planet in top] == [(4, 2)]
+
+
+def test_rebuild_command(app, client):
+    client.post("/favorite/1/planets/1")
+    client.post("/favorite/2/planets/3")
+    # favorites written around the API, and a count that drifted
+    with app.app_context():
+        db.session.add(Favorites(user_id=3, kind=1, entity_id=1))
+        db.session.get(Favorite_counts, (1, 3)).count = 7
+        db.session.commit()
+    result = app.test_cli_runner().invoke(args=["rebuild-favorite-counts"])
+    assert result.exit_code == 0, result.output
+    kept, rebuilt = counts(app)
+    assert kept == rebuilt == [(1, 1, 2), (1, 3, 1)]
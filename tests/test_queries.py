@@ -0,0 +1,78 @@
+"""
+The keyset pages of the collection endpoints, and the cursors clients send back: anything
+the database could not compare with the sort column is a 400, never a 500.
+"""
+import base64
+import json
+
+import pytest
+
+from models import db, Planets
+
+
+def cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+@pytest.fixture
+def planets(app):
+    with app.app_context():
+        db.session.add_all(Planets(name="planet %d" % i, description="d", imageLink="i") for i in range(1, 6))
+        db.session.commit()
+
+
+def test_pages_sorted_by_name(client, planets):
+    names = []
+    after = None
+    while True:
+        response = client.get("/planets", query_string={"sort": "-name", "limit": 2, "after": after or ""})
+        assert response.status_code == 200
+        names += [planet["name"] for planet in response.get_json()["planets"]]
+        after = response.get_json()["next"]
+        if after is None:
+            break
+    assert names == ["planet %d" % i for i in range(5, 0, -1)]
+
+
+def test_pages_sorted_by_id(client, planets):
+    response = client.get("/planets?limit=2&after=2")
+    assert [planet["id"] for planet in response.get_json()["planets"]] == [3, 4]
+    assert response.get_json()["next"] == 4
+
+
+@pytest.mark.parametrize("after", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"not json").decode(),
+    cursor({"name": "planet 1"}),
+    cursor(["planet 1"]),
+    cursor(["planet 1", 1, 2]),
+    cursor([["planet 1"], 1]),
+    cursor([{"name": "planet 1"}, 1]),
+    cursor([None, 1]),
+    cursor([True, 1]),
+    cursor(["planet 1", "1"]),
+    cursor(["planet 1", 1.5]),
+    # a number where the name is, a 500 on PostgreSQL (character varying > integer)
+    cursor([5, 1]),
+    cursor([5.5, 1]),
+])
+def test_invalid_cursor(client, planets, after):
+    response = client.get("/planets", query_string={"sort": "name", "after": after})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Invalid cursor"
+
+
+def test_id_cursor_must_be_an_integer(client, planets):
+    response = client.get("/planets", query_string={"after": cursor(["planet 1", 1])})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("query, message", [
+    ("fields=,", "fields must name at least one field"),
+    ("fields=nope", "Unknown fields: nope"),
+    ("sort=description", "sort must be one of: id, name"),
+])
+def test_invalid_arguments(client, planets, query, message):
+    response = client.get("/planets?" + query)
+    assert response.status_code == 400
+    assert response.get_json()["message"] == message